@@ -0,0 +1,265 @@
+"""
+In process availability index.
+
+Holds one bytearray per use year for actual points and per (owner, use year) for personal points,
+indexed by point number, recording which points are unallocated and whether they are banked.
+Point counts are then answered from memory instead of the database.  Allocating and banking still
+claim their points in the database, which holds the row locks and banked dates the index does not.
+
+Enabled with AVAILABILITY_INDEX = True in config.py.  The index is loaded when the worker starts.
+Allocations, releases and banks record the points they changed with record(), and the bits of those
+points are set when the session commits, so this worker never rereads the points tables on a write.
+A background thread checks the index against the database every AVAILABILITY_INDEX_CHECK_SECONDS,
+outside any request, to pick up changes committed by other workers.
+"""
+import threading
+import time
+
+from dateutil.relativedelta import relativedelta
+from flask import current_app
+from sqlalchemy import event, func
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import db, ActualPoint, PersonalPoint
+from point_ranges import RANGE_MODELS, point_model, is_range_model
+
+# one byte per point number
+UNAVAILABLE = 0  # allocated to a trip, or no such point
+FREE = 1  # unallocated and not banked
+BANKED = 2  # unallocated and banked
+
+
+def _point_numbers(model, row):
+    """ The point numbers held by a row of either point storage """
+    if is_range_model(model):
+        return range(row.start_point_number, row.end_point_number + 1)
+    return (row.point_number,)
+
+
+def _mark(bitmaps, key, point_numbers, state):
+    bitmap = bitmaps.setdefault(key, bytearray())
+    last_point_number = max(point_numbers)
+    if last_point_number >= len(bitmap):
+        bitmap.extend(bytes(last_point_number + 1 - len(bitmap)))
+    for point_number in point_numbers:
+        bitmap[point_number] = state
+
+
+def _in_window(use_year, after, before):
+    return (after is None or use_year > after) and (before is None or use_year < before)
+
+
+def _within(transaction, ancestor):
+    while transaction is not None:
+        if transaction is ancestor:
+            return True
+        transaction = transaction.parent
+    return False
+
+
+def _summary(bitmap, state):
+    """ How many points of bitmap are in state, and the sum of their point numbers """
+    point_numbers = [point_number for point_number, point_state in enumerate(bitmap) if point_state == state]
+    return [len(point_numbers), sum(point_numbers)]
+
+
+class AvailabilityIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.actual = {}  # use_year -> bytearray
+        self.personal = {}  # (owner_id, use_year) -> bytearray
+        self.loaded = False
+
+    @staticmethod
+    def enabled():
+        return current_app.config.get('AVAILABILITY_INDEX', False)
+
+    def _load_actual(self, after=None, before=None):
+        model = point_model(ActualPoint)
+        query = db.session.query(model).filter(model.trip_id.is_(None))
+        if after is not None:
+            query = query.filter(model.use_year > after)
+        if before is not None:
+            query = query.filter(model.use_year < before)
+        bitmaps = {}
+        for row in query.yield_per(5000):
+            _mark(bitmaps, row.use_year, _point_numbers(model, row), BANKED if row.banked_date else FREE)
+        return bitmaps
+
+    def _load_personal(self, owner_id=None):
+        model = point_model(PersonalPoint)
+        query = db.session.query(model).filter(model.trip_id.is_(None))
+        if owner_id is not None:
+            query = query.filter(model.owner_id == owner_id)
+        bitmaps = {}
+        for row in query.yield_per(5000):
+            _mark(bitmaps, (row.owner_id, row.use_year), _point_numbers(model, row), FREE)
+        return bitmaps
+
+    def load(self):
+        """ Build the index, once: requests arriving while it is built wait for it """
+        with self._lock:
+            if self.loaded:
+                return
+            actual = self._load_actual()
+            personal = self._load_personal()
+            self.actual = actual
+            self.personal = personal
+            self.loaded = True
+
+    def refresh_actual(self, after, before):
+        """ Reload the actual point use years strictly between after and before """
+        if not self.loaded:
+            return
+        actual = self._load_actual(after, before)
+        with self._lock:
+            for use_year in [use_year for use_year in self.actual if _in_window(use_year, after, before)]:
+                del self.actual[use_year]
+            self.actual.update(actual)
+
+    def refresh_personal(self, owner_id):
+        """ Reload every use year of an owner's personal points """
+        if not self.loaded:
+            return
+        personal = self._load_personal(owner_id)
+        with self._lock:
+            for key in [key for key in self.personal if key[0] == owner_id]:
+                del self.personal[key]
+            self.personal.update(personal)
+
+    def record(self, model, rows, state=None):
+        """ Set the points held by rows of model, from either point storage, to state once the session
+            commits, or with no state back to unallocated, banked or not.  The rows are read now, as the
+            commit expires them """
+        if not self.loaded:
+            return
+        personal = model in (PersonalPoint, RANGE_MODELS[PersonalPoint])
+        session = db.session()
+        changes = session.info.setdefault('availability_changes', [])
+        for row in rows:
+            row_state = state
+            if row_state is None:
+                row_state = BANKED if getattr(row, 'banked_date', None) else FREE
+            changes.append((session.transaction, personal,
+                            (row.owner_id, row.use_year) if personal else row.use_year,
+                            _point_numbers(model, row), row_state))
+
+    def apply(self, changes):
+        with self._lock:
+            for transaction, personal, key, point_numbers, state in changes:
+                _mark(self.personal if personal else self.actual, key, point_numbers, state)
+
+    def check_consistency(self):
+        """ Compare the count and the sum of the point numbers of every use year and owner with the
+            database, reload any that differ and return the keys that were out of date """
+        actual_model = point_model(ActualPoint)
+        personal_model = point_model(PersonalPoint)
+        if is_range_model(actual_model):
+            def summary(model):
+                return (func.sum(model.end_point_number - model.start_point_number + 1),
+                        func.sum((model.start_point_number + model.end_point_number) *
+                                 (model.end_point_number - model.start_point_number + 1) / 2))
+        else:
+            def summary(model):
+                return func.count(model.id), func.sum(model.point_number)
+
+        expected_actual = {}
+        for use_year, banked, point_count, point_number_sum in db.session.query(
+                actual_model.use_year, actual_model.banked_date.isnot(None), *summary(actual_model)).\
+                filter(actual_model.trip_id.is_(None)).\
+                group_by(actual_model.use_year, actual_model.banked_date.isnot(None)):
+            expected_actual[(use_year, BANKED if banked else FREE)] = [point_count, point_number_sum]
+        expected_personal = dict(((owner_id, use_year), [point_count, point_number_sum])
+                                 for owner_id, use_year, point_count, point_number_sum in
+                                 db.session.query(personal_model.owner_id, personal_model.use_year,
+                                                  *summary(personal_model)).
+                                 filter(personal_model.trip_id.is_(None)).
+                                 group_by(personal_model.owner_id, personal_model.use_year))
+
+        no_points = [0, 0]
+        with self._lock:
+            stale_use_years = sorted(use_year for use_year in set(key[0] for key in expected_actual) | set(self.actual)
+                                     if any(expected_actual.get((use_year, state), no_points) !=
+                                            _summary(self.actual.get(use_year, b''), state)
+                                            for state in (FREE, BANKED)))
+            stale_owners = set(key[0] for key in set(expected_personal) | set(self.personal)
+                               if expected_personal.get(key, no_points) !=
+                               _summary(self.personal.get(key, b''), FREE))
+        for use_year in stale_use_years:
+            self.refresh_actual(use_year + relativedelta(seconds=-1), use_year + relativedelta(seconds=+1))
+        for owner_id in stale_owners:
+            self.refresh_personal(owner_id)
+        if stale_use_years or stale_owners:
+            current_app.logger.info('AVAILABILITY INDEX - reloaded use years %s and owners %s',
+                                    stale_use_years, sorted(stale_owners))
+        return stale_use_years, stale_owners
+
+    def start_checks(self, app):
+        """ Run check_consistency every AVAILABILITY_INDEX_CHECK_SECONDS on a daemon thread, or load the
+            index when it could not be loaded yet """
+        def check_periodically():
+            while True:
+                time.sleep(app.config.get('AVAILABILITY_INDEX_CHECK_SECONDS', 60))
+                with app.app_context():
+                    try:
+                        if self.loaded:
+                            self.check_consistency()
+                        else:
+                            self.load()
+                    except SQLAlchemyError as e:
+                        app.logger.error('AVAILABILITY INDEX - background check failed: %s', e)
+                    finally:
+                        db.session.remove()
+        threading.Thread(target=check_periodically, name='availability-index-check', daemon=True).start()
+
+    def ready(self):
+        """ True when counts can be served from the index, loading it first if needed.  False when it
+            cannot be loaded, so the counts fall back to the database """
+        if not self.enabled():
+            return False
+        if not self.loaded:
+            try:
+                self.load()
+            except SQLAlchemyError as e:
+                db.session.rollback()
+                current_app.logger.error('AVAILABILITY INDEX - not loaded: %s', e)
+                return False
+        return True
+
+    def actual_count(self, after, before, state):
+        with self._lock:
+            return sum(bitmap.count(state) for use_year, bitmap in self.actual.items()
+                       if _in_window(use_year, after, before))
+
+    def personal_count(self, owner_id, after, before):
+        with self._lock:
+            return sum(bitmap.count(FREE) for (bitmap_owner_id, use_year), bitmap in self.personal.items()
+                       if bitmap_owner_id == owner_id and _in_window(use_year, after, before))
+
+
+availability_index = AvailabilityIndex()
+
+
+@event.listens_for(db.session, 'after_commit')
+def apply_committed_changes(session):
+    """ Set the bits recorded in the transaction, once it is committed rather than a savepoint """
+    if session.transaction.nested:
+        return
+    changes = session.info.pop('availability_changes', None)
+    if changes:
+        availability_index.apply(changes)
+
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def forget_rolled_back_changes(session, previous_transaction):
+    """ Drop the changes recorded in a rolled back transaction or savepoint """
+    changes = session.info.get('availability_changes')
+    if changes:
+        changes[:] = [change for change in changes if not _within(change[0], previous_transaction)]
+
+
+@event.listens_for(db.session, 'after_transaction_end')
+def forget_uncommitted_changes(session, transaction):
+    """ Drop what is left when the transaction ends without committing, closed rather than rolled back """
+    if transaction.parent is None:
+        session.info.pop('availability_changes', None)
@@ -0,0 +1,85 @@
+"""
+Precomputed availability calendar.
+
+For every month over the next AVAILABILITY_CALENDAR_YEARS years, the actual points and each owner's
+personal points a trip checking in on the first of that month could use if it were booked today,
+split banked/current/borrow with the same windows as allocate_trip_points in views_trips.py.
+
+The document is built once from a PointSnapshot and kept in memory.  This worker rebuilds it after
+every allocation, release and bank it commits; changes committed by other workers are picked up once
+the document is older than AVAILABILITY_CALENDAR_MAX_AGE seconds.
+"""
+import threading
+import time
+from datetime import datetime
+
+from dateutil.relativedelta import relativedelta
+from flask import current_app
+
+from models import db, Owner
+from point_simulation import PointSnapshot
+
+BUCKETS = ('banked', 'current', 'borrow')
+
+
+def _bucket_counts(buckets, position):
+    counts = dict((bucket_name, int(bucket[position])) for bucket_name, bucket in zip(BUCKETS, buckets))
+    counts['total'] = sum(counts.values())
+    return counts
+
+
+def build_calendar(booked_date):
+    first_month = datetime(booked_date.year, booked_date.month, 1)
+    months = [first_month + relativedelta(months=month)
+              for month in range(12 * current_app.config.get('AVAILABILITY_CALENDAR_YEARS', 3))]
+    owners = db.session.query(Owner.id, Owner.name).order_by(Owner.name).all()
+
+    # one candidate per (month, owner), plus one per month for the actual points when there are no owners
+    owner_ids = [owner_id for month in months for owner_id, name in owners or [(None, None)]]
+    check_in_dates = [month for month in months for owner in owners or [None]]
+    personal_buckets, actual_buckets = PointSnapshot().buckets(owner_ids, check_in_dates,
+                                                               [booked_date] * len(check_in_dates))
+
+    calendar = []
+    for month_number, month in enumerate(months):
+        first_position = month_number * max(len(owners), 1)
+        calendar.append({
+            'month': month.strftime('%Y-%m'),
+            'actual_points': _bucket_counts(actual_buckets, first_position),
+            'personal_points': [dict(_bucket_counts(personal_buckets, first_position + owner_number),
+                                     owner_id=owner_id, name=name)
+                                for owner_number, (owner_id, name) in enumerate(owners)]})
+    return {'generated_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'booked_date': booked_date.strftime('%Y-%m-%d'),
+            'months': calendar}
+
+
+class AvailabilityCalendar:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.document = None
+        self.built_at = 0
+
+    def _build(self):
+        document = build_calendar(datetime.now())
+        with self._lock:
+            self.document = document
+            self.built_at = time.time()
+        return document
+
+    def get(self):
+        """ The calendar document, rebuilt first when missing or older than the max age """
+        with self._lock:
+            document = self.document
+            age = time.time() - self.built_at
+        if document is None or age > current_app.config.get('AVAILABILITY_CALENDAR_MAX_AGE', 300):
+            document = self._build()
+        return document
+
+    def refresh(self):
+        """ Rebuild after points were allocated, released or banked, if this worker has built the calendar """
+        if self.document is not None:
+            self._build()
+
+
+availability_calendar = AvailabilityCalendar()
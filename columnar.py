@@ -0,0 +1,54 @@
+"""
+Columnar representation of the point lists.
+
+With ?format=columnar the point list endpoints return one array per column instead of one object per
+point, read straight from the selected columns without building ORM objects:
+
+    {"format": "columnar", "count": 2, "url_template": "https://host/api/actual_points/{id}",
+     "columns": {"id": [1, 2], "use_year": ["2021-02-01T00:00:00", ...], ...}}
+
+The per point url is left out; clients that want it fill the id into url_template.  Combined with
+?limit= and ?cursor= the response also carries limit and next_cursor, as the paged lists do.
+"""
+from flask import request, url_for
+from sqlalchemy import DateTime
+import status
+
+from fast_serializers import URL_SENTINEL
+from models import db
+from pagination import pagination_requested, keyset_rows
+
+
+def columnar_requested():
+    return request.args.get('format', '').lower() == 'columnar'
+
+
+def _column_values(column, values):
+    if isinstance(column.type, DateTime):
+        return [None if value is None else value.isoformat() for value in values]
+    return list(values)
+
+
+def columnar_page(columns, key_column, endpoint, **extra):
+    """ The rows of columns, the whole collection or the requested page, as parallel arrays """
+    query = db.session.query(*columns)
+    limit = next_cursor = None
+    if pagination_requested():
+        try:
+            rows, limit, next_cursor = keyset_rows(query, key_column)
+        except ValueError as e:
+            resp = {'message': str(e)}
+            return resp, status.HTTP_400_BAD_REQUEST
+    else:
+        rows = query.order_by(key_column).all()
+
+    column_values = list(zip(*rows)) or [()] * len(columns)
+    result = {'format': 'columnar',
+              'count': len(rows),
+              'url_template': url_for(endpoint, id=URL_SENTINEL, _external=True).replace(str(URL_SENTINEL), '{id}'),
+              'columns': dict((column.key, _column_values(column, values))
+                              for column, values in zip(columns, column_values))}
+    result.update(extra)
+    if limit is not None:
+        result.update({'limit': limit, 'next_cursor': next_cursor})
+    return result
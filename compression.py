@@ -0,0 +1,62 @@
+"""
+Response compression.
+
+Compresses JSON responses of at least COMPRESS_MIN_SIZE bytes with the best encoding the client
+accepts: brotli when the brotli package is installed, otherwise gzip.  Levels are set with
+COMPRESS_GZIP_LEVEL and COMPRESS_BROTLI_QUALITY in config.py and the whole thing can be switched off
+with COMPRESS_ENABLED = False.  Streamed responses (?stream=true) are sent as they are.
+"""
+import zlib
+
+from flask import current_app, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = ('application/json', 'text/html', 'text/plain')
+
+
+def gzip_compress(data, level):
+    """ gzip without a timestamp, so the same response always compresses to the same bytes """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def negotiate_encoding(accept_encodings):
+    """ The encoding to use for a request's Accept-Encoding, or None """
+    encodings = ['br', 'gzip'] if brotli is not None else ['gzip']
+    # max keeps the first of equally weighted encodings, so brotli wins a tie
+    encoding = max(encodings, key=lambda encoding: accept_encodings[encoding])
+    if accept_encodings[encoding] <= 0:
+        return None
+    return encoding
+
+
+def compress_response(response):
+    config = current_app.config
+    if not config.get('COMPRESS_ENABLED', True) or response.mimetype not in COMPRESSIBLE_MIMETYPES:
+        return response
+    response.vary.add('Accept-Encoding')
+    if response.status_code < 200 or response.status_code >= 300 or response.status_code == 204 \
+            or response.direct_passthrough or response.is_streamed \
+            or 'Content-Encoding' in response.headers:
+        return response
+
+    data = response.get_data()
+    if len(data) < config.get('COMPRESS_MIN_SIZE', 1024):
+        return response
+    encoding = negotiate_encoding(request.accept_encodings)
+    if encoding == 'br':
+        response.set_data(brotli.compress(data, quality=config.get('COMPRESS_BROTLI_QUALITY', 4)))
+    elif encoding == 'gzip':
+        response.set_data(gzip_compress(data, config.get('COMPRESS_GZIP_LEVEL', 6)))
+    else:
+        return response
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def init_compression(app):
+    app.after_request(compress_response)
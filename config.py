@@ -17,5 +17,33 @@ SQLALCHEMY_DATABASE_URI = "postgres://{DB_USER}:{DB_PASS}@{DB_ADDR}:5432/{DB_NAM
     DB_NAME=gcp_auth.gcp_db['db_name'])
 SQLALCHEMY_MIGRATE_REPO = os.path.join(basedir, 'db_repository')
 SQLALCHEMY_POOL_RECYCLE = 60
+# 'rows' stores one row per point, 'ranges' stores contiguous runs of points (see point_ranges.py)
+POINT_STORAGE = 'rows'
+# serve point counts from the in process bitmaps in availability.py, checked against the db every N seconds
+# by a background thread
+AVAILABILITY_INDEX = False
+AVAILABILITY_INDEX_CHECK_SECONDS = 60
+# months covered by /availability_calendar/, and how old the cached calendar may get before it is rebuilt
+AVAILABILITY_CALENDAR_YEARS = 3
+AVAILABILITY_CALENDAR_MAX_AGE = 300
+# resorts, room types and bookable rooms are cached in process (see reference_data.py) and checked against
+# the table change counters every N seconds for writes made by other workers
+REFERENCE_DATA_CHECK_SECONDS = 60
+# owner email -> owner id, name and access level lookups kept in process (see identity_cache.py): at most
+# this many emails, each for at most this many seconds
+IDENTITY_CACHE_SIZE = 1024
+IDENTITY_CACHE_TTL = 300
+# gzip (or brotli, when installed) JSON responses of at least COMPRESS_MIN_SIZE bytes, see compression.py
+COMPRESS_ENABLED = True
+COMPRESS_MIN_SIZE = 1024
+COMPRESS_GZIP_LEVEL = 6
+COMPRESS_BROTLI_QUALITY = 4
+# share of requests (0 to 1) that count their SQL statements and time and send a Server-Timing header,
+# see instrumentation.py
+INSTRUMENT_SAMPLE_RATE = 0.05
+# report a SELECT run with NPLUSONE_THRESHOLD or more different parameters in one request, see nplusone.py:
+# None is off, 'warn' logs it (staging), 'raise' fails the request (tests)
+NPLUSONE_MODE = None
+NPLUSONE_THRESHOLD = 3
 
 print('ACTIVE DB: ' + gcp_auth.gcp_db['db_name'])
@@ -0,0 +1,76 @@
+"""
+CPU cost against bytes saved of the response compression in compression.py.
+
+Builds /trips/ and /actual_points/ payloads of typical size in memory and, for each gzip level and
+(when the brotli package is installed) brotli quality, prints the compressed size and the median
+time to compress one response:
+    python bench_compression.py
+
+No database is needed, the payloads are dumped from objects that are never added to a session.
+"""
+import json
+import os
+import statistics
+import sys
+import time
+
+from flask import Flask
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import bench_serializers  # noqa: E402
+from compression import brotli, gzip_compress  # noqa: E402
+from fast_serializers import fast_serializer  # noqa: E402
+from views import api_bp  # noqa: E402
+
+bench_serializers.TRIPS = 250
+bench_serializers.POINTS = 5000
+GZIP_LEVELS = (1, 6, 9)
+BROTLI_QUALITIES = (1, 4, 6)
+REPEATS = 25
+
+
+def payloads():
+    lists = dict((name, (schema, objects)) for name, schema, objects in bench_serializers.build_objects())
+    for endpoint, name in (('/trips/', 'trips'), ('/actual_points/', 'actual points')):
+        schema, objects = lists[name]
+        # as flask-restful encodes a resource's return value
+        yield endpoint, (json.dumps(fast_serializer(schema).dump(objects, many=True)) + '\n').encode()
+
+
+def codecs():
+    for level in GZIP_LEVELS:
+        yield 'gzip %s' % level, lambda data, level=level: gzip_compress(data, level)
+    if brotli is not None:
+        for quality in BROTLI_QUALITIES:
+            yield 'br %s' % quality, lambda data, quality=quality: brotli.compress(data, quality=quality)
+
+
+def time_ms(compress, data):
+    samples = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        compress(data)
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    app = Flask(__name__)
+    app.register_blueprint(api_bp, url_prefix='/api')
+
+    with app.test_request_context('/api/trips/'):
+        print('%16s %10s %12s %10s %8s %14s' % ('endpoint', 'encoding', 'bytes', 'saved', 'ratio', 'ms / request'))
+        for endpoint, data in payloads():
+            print('%16s %10s %12s %10s %8s %14s' % (endpoint, 'identity', len(data), 0, '1.0x', '0.00'))
+            for name, compress in codecs():
+                compressed = compress(data)
+                print('%16s %10s %12s %10s %7.1fx %14.2f' % (endpoint, name, len(compressed), len(data) - len(compressed),
+                                                             len(data) / len(compressed), time_ms(compress, data)))
+    if brotli is None:
+        print('brotli is not installed, only gzip was measured')
+
+
+if __name__ == '__main__':
+    main()
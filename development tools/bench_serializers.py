@@ -0,0 +1,114 @@
+"""
+Microbenchmark of the precompiled serializers in fast_serializers.py against the marshmallow schemas.
+
+Dumps in memory trip, owner, bookable room and point lists with both, checks the encoded JSON is
+byte for byte the same and prints the median time of each:
+    python bench_serializers.py
+
+No database is needed, the objects are never added to a session.
+"""
+import datetime
+import json
+import os
+import statistics
+import sys
+import time
+
+from flask import Flask
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from models import Owner, OwnerEmail, Resort, RoomType, BookableRoom, ActualPoint, PersonalPoint, Trip, \
+    TripSchema, OwnerSchema, BookableRoomSchema, ActualPointScheme, PersonalPointSchema  # noqa: E402
+from fast_serializers import fast_serializer  # noqa: E402
+from views import api_bp  # noqa: E402
+
+TRIPS = 2000
+POINTS = 10000
+REPEATS = 9
+
+
+def build_objects():
+    owners = []
+    for owner_number in range(1, 9):
+        owner = Owner('Owner %s' % owner_number)
+        owner.id = owner_number
+        for email_number in range(1, 3):
+            owner_email = OwnerEmail('owner%s.%s@example.com' % (owner_number, email_number), owner)
+            owner_email.id = owner_number * 10 + email_number
+            owner_email.access_level = 2
+        owners.append(owner)
+    bookable_rooms = []
+    for room_number in range(1, 7):
+        resort = Resort('Resort %s' % room_number)
+        resort.id = room_number
+        room_type = RoomType('Room Type %s' % room_number, sleeps=4)
+        room_type.id = room_number
+        bookable_room = BookableRoom(resort, room_type)
+        bookable_room.id = room_number
+        bookable_rooms.append(bookable_room)
+
+    trips = []
+    for trip_number in range(1, TRIPS + 1):
+        trip = Trip(owners[trip_number % len(owners)], bookable_rooms[trip_number % len(bookable_rooms)])
+        trip.id = trip_number
+        trip.check_in_date = datetime.datetime(2021, 1, 1) + datetime.timedelta(days=trip_number % 700)
+        trip.check_out_date = trip.check_in_date + datetime.timedelta(days=5)
+        trip.booked_date = trip.check_in_date + datetime.timedelta(days=-60)
+        trip.notes = 'trip %s' % trip_number
+        trip.points_needed = 100 + trip_number % 50
+        trips.append(trip)
+
+    actual_points = []
+    personal_points = []
+    for point_number in range(POINTS):
+        use_year = datetime.datetime(2020 + point_number // 5000, 2, 1)
+        actual_point = ActualPoint(use_year, point_number % 5000)
+        actual_point.id = point_number + 1
+        actual_point.trip_id = point_number % 7 or None
+        actual_point.banked_date = datetime.datetime(2021, 1, 1) if point_number % 11 == 0 else None
+        actual_points.append(actual_point)
+        personal_point = PersonalPoint(use_year, point_number % 5000, owners[point_number % len(owners)].id)
+        personal_point.owner = owners[point_number % len(owners)]
+        personal_point.id = point_number + 1
+        personal_points.append(personal_point)
+    return [('trips', TripSchema(), trips),
+            ('owners', OwnerSchema(), owners),
+            ('bookable rooms', BookableRoomSchema(), bookable_rooms),
+            ('actual points', ActualPointScheme(), actual_points),
+            ('personal points', PersonalPointSchema(), personal_points),
+            ('trips ?fields=', TripSchema(only=('id', 'check_in_date', 'points_needed', 'owner.name')), trips)]
+
+
+def time_ms(dump, objects):
+    samples = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        dump(objects, many=True)
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    app = Flask(__name__)
+    app.register_blueprint(api_bp, url_prefix='/api')
+
+    failures = []
+    with app.test_request_context('/api/trips/'):
+        print('%16s %8s %16s %16s %8s' % ('list', 'objects', 'marshmallow (ms)', 'compiled (ms)', 'speedup'))
+        for name, schema, objects in build_objects():
+            serializer = fast_serializer(schema)
+            if json.dumps(schema.dump(objects, many=True)) != json.dumps(serializer.dump(objects, many=True)):
+                failures.append('%s: compiled output differs from the schema' % name)
+            marshmallow_ms = time_ms(schema.dump, objects)
+            compiled_ms = time_ms(serializer.dump, objects)
+            print('%16s %8s %16.2f %16.2f %7.1fx' % (name, len(objects), marshmallow_ms, compiled_ms,
+                                                    marshmallow_ms / compiled_ms))
+
+    for failure in failures:
+        print('FAIL - ' + failure)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,9 @@
+import hashlib
 from functools import wraps
+from urllib.parse import urlencode
 from flask_jwt_extended import get_jwt_claims
-from flask import jsonify
+from flask import g, jsonify, request, Response
+from models import table_versions
 import status
 
 
@@ -26,3 +29,53 @@ def jwt_access_level(access_level):
                 return orig_func(*args, **kwargs)
         return decorated_function
     return actual_decorator
+
+
+def _representation_etag(versions):
+    """ The change counters, and a hash of the sorted query arguments when there are any, as each of
+        ?fields=, ?limit=, ?cursor=, ?stream= or ?format= picks a different body for the same counters """
+    etag = '.'.join(str(version) for version in versions)
+    args = sorted(request.args.items(multi=True))
+    if args:
+        etag += '-' + hashlib.sha1(urlencode(args).encode('utf-8')).hexdigest()[:16]
+    return etag
+
+
+def conditional_get(*table_names):
+    """ ETag a GET from the change counters of the tables its response is built from and answer a
+        matching If-None-Match with 304 before the handler runs any query.  The ETag is shared by the
+        compressed and plain bodies, so it varies on Accept-Encoding """
+    def actual_decorator(orig_func):
+        @wraps(orig_func)
+        def decorated_function(*args, **kwargs):
+            if request.method != 'GET':
+                return orig_func(*args, **kwargs)
+            versions = table_versions(table_names)
+            if versions is None:
+                # no ETag until the counters can be read
+                return orig_func(*args, **kwargs)
+            etag = _representation_etag(versions)
+            # the handler's cached data must be at least this new (see reference_data.py)
+            g.table_versions = dict(zip(table_names, versions))
+            if request.if_none_match.contains_weak(etag):
+                resp = Response(status=status.HTTP_304_NOT_MODIFIED)
+                resp.set_etag(etag, weak=True)
+                resp.vary.add('Accept-Encoding')
+                return resp
+
+            resp = orig_func(*args, **kwargs)
+            if isinstance(resp, Response):
+                if resp.status_code == status.HTTP_200_OK:
+                    resp.set_etag(etag, weak=True)
+                    resp.vary.add('Accept-Encoding')
+                return resp
+            if not isinstance(resp, tuple):
+                resp = (resp, status.HTTP_200_OK)
+            if resp[1] != status.HTTP_200_OK:
+                return resp
+            headers = dict(resp[2]) if len(resp) > 2 else {}
+            headers['ETag'] = 'W/"%s"' % etag
+            headers['Vary'] = 'Accept-Encoding'
+            return resp[0], resp[1], headers
+        return decorated_function
+    return actual_decorator
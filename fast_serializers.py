@@ -0,0 +1,188 @@
+"""
+Precompiled serializers for the hot list endpoints.
+
+A FastSerializer is compiled once from a marshmallow schema instance into a flat list of
+(key, getter) pairs and dumps an object by building the dict directly, skipping marshmallow's per
+field dispatch.  URLFor fields are built from a URL template cached per endpoint and url root
+instead of calling url_for for every row:  the template is rendered once by url_for with a sentinel
+id and the real id is spliced in.  The templates of the request's url root are looked up once per
+dump() call, not once per object.
+
+Output is identical to schema.dump():  the keys come out in the order of the schema instance's own
+dump_fields and every value is formatted as the marshmallow field would.  Schemas using a field type
+or dump hook the compiler does not know about are dumped with marshmallow unchanged.
+
+Serializers compiled at import time, outside any request, are kept for the life of the process.  Those
+first asked for by a request, one per ?fields= selection, are kept MAX_SERIALIZERS at a time and the
+least recently used is dropped, so clients naming new field lists cannot grow the cache without bound.
+"""
+import re
+import threading
+from collections import OrderedDict
+
+from flask import has_request_context, request, url_for
+from flask_marshmallow.fields import URLFor, _tpl
+from marshmallow import fields, utils
+from marshmallow.decorators import POST_DUMP, PRE_DUMP
+
+from instrumentation import serializing
+
+URL_SENTINEL = 1000000007
+MAX_URL_ROOTS = 16
+MAX_SERIALIZERS = 64
+
+_url_templates = {}
+_serializers = {}
+_request_serializers = OrderedDict()
+_request_serializers_lock = threading.Lock()
+
+
+def _url_template(endpoint, literal_values, attribute_params):
+    """ The url of endpoint split around each attribute parameter, or False when it can not be split """
+    sentinels = dict((param, URL_SENTINEL + position) for position, param in enumerate(attribute_params))
+    url = url_for(endpoint, **dict(literal_values, **sentinels))
+    pieces = re.split('(%s)' % '|'.join(str(sentinel) for sentinel in sentinels.values()), url)
+    # every attribute parameter must appear exactly once, in order, for the template to be usable
+    if pieces[1::2] != [str(sentinels[param]) for param in attribute_params]:
+        return False
+    return pieces[0::2]
+
+
+def _url_templates_for_request():
+    """ The url templates of the current url root, urls being external """
+    url_root = request.url_root if has_request_context() else None
+    templates = _url_templates.get(url_root)
+    if templates is None:
+        if len(_url_templates) >= MAX_URL_ROOTS:
+            _url_templates.clear()
+        templates = _url_templates[url_root] = {}
+    return templates
+
+
+def _get(obj, attr_name):
+    """ getattr, reading loaded column and relationship values straight from the instance """
+    state = obj.__dict__
+    if attr_name in state:
+        return state[attr_name]
+    return getattr(obj, attr_name)
+
+
+def _compile_url(field):
+    literal_values = {}
+    attributes = []
+    for param, attr_tpl in field.values.items():
+        attr_name = _tpl(str(attr_tpl))
+        if attr_name:
+            attributes.append((param, attr_name))
+        else:
+            literal_values[param] = attr_tpl
+    attribute_params = [param for param, attr_name in attributes]
+    template_key = (field.endpoint, tuple(attribute_params))
+
+    def dump_url(obj, templates):
+        attribute_values = [_get(obj, attr_name) for param, attr_name in attributes]
+        if any(value is None for value in attribute_values):
+            return None
+        template = templates.get(template_key)
+        if template is None:
+            template = templates[template_key] = _url_template(field.endpoint, literal_values, attribute_params)
+        if template is False or any(type(value) is not int for value in attribute_values):
+            return url_for(field.endpoint, **dict(literal_values, **dict(zip(attribute_params, attribute_values))))
+        url = template[0]
+        for value, piece in zip(attribute_values, template[1:]):
+            url += str(value) + piece
+        return url
+    return dump_url
+
+
+def _dump_attribute(attr_name, convert):
+    def dump_value(obj, templates):
+        value = _get(obj, attr_name)
+        return None if value is None else convert(value)
+    return dump_value
+
+
+def _dump_nested(attr_name, nested_dump, many):
+    def dump_value(obj, templates):
+        value = _get(obj, attr_name)
+        if value is None:
+            return None
+        if many:
+            return [nested_dump(item, templates) for item in value]
+        return nested_dump(value, templates)
+    return dump_value
+
+
+def _compile_value(field, attr_name):
+    """ A function dumping one field of an object, or None when the field is not supported """
+    if isinstance(field, URLFor):
+        return _compile_url(field)
+    if '.' in attr_name or field.default is not utils.missing:
+        return None
+    if isinstance(field, fields.Nested):
+        nested_dump = _compile_schema(field.schema)
+        if nested_dump is None:
+            return None
+        return _dump_nested(attr_name, nested_dump, field.schema.many or field.many)
+    if type(field) is fields.Integer and not field.as_string:
+        return _dump_attribute(attr_name, int)
+    if type(field) is fields.String:
+        return _dump_attribute(attr_name, utils.ensure_text_type)
+    if type(field) is fields.DateTime and field.format in (None, 'iso'):
+        return _dump_attribute(attr_name, utils.isoformat)
+    return None
+
+
+def _compile_schema(schema):
+    """ A function dumping one object exactly as schema.dump, or None if the schema can not be compiled """
+    if schema._has_processors(PRE_DUMP) or schema._has_processors(POST_DUMP):
+        return None
+    compiled = []
+    for name, field in schema.dump_fields.items():
+        dump_value = _compile_value(field, field.attribute or name)
+        if dump_value is None:
+            return None
+        compiled.append((field.data_key if field.data_key is not None else name, dump_value))
+    return lambda obj, templates: {key: dump_value(obj, templates) for key, dump_value in compiled}
+
+
+def _signature(schema):
+    """ What a compiled serializer depends on: the schema class, field order and nested schemas """
+    return (type(schema), schema.many,
+            tuple((name, _signature(field.schema) if isinstance(field, fields.Nested) else None)
+                  for name, field in schema.dump_fields.items()))
+
+
+class FastSerializer:
+    def __init__(self, schema):
+        self.schema = schema
+        self._dump_one = _compile_schema(schema)
+
+    def dump(self, obj, many=None):
+        many = self.schema.many if many is None else many
+        if self._dump_one is None:
+            return self.schema.dump(obj, many=many)
+        with serializing():
+            templates = _url_templates_for_request()
+            if many:
+                return [self._dump_one(item, templates) for item in obj]
+            return self._dump_one(obj, templates)
+
+
+def fast_serializer(schema):
+    """ The compiled serializer for a schema instance, shared by every instance with the same signature """
+    signature = _signature(schema)
+    serializer = _serializers.get(signature)
+    if serializer is not None:
+        return serializer
+    if not has_request_context():
+        serializer = _serializers[signature] = FastSerializer(schema)
+        return serializer
+    with _request_serializers_lock:
+        serializer = _request_serializers.pop(signature, None)
+        if serializer is None:
+            serializer = FastSerializer(schema)
+        _request_serializers[signature] = serializer
+        if len(_request_serializers) > MAX_SERIALIZERS:
+            _request_serializers.popitem(last=False)
+    return serializer
@@ -0,0 +1,89 @@
+"""
+Sparse fieldsets for the trip, owner and bookable room endpoints.
+
+    ?fields=id,check_in_date,points_needed,owner.name    only these fields, nested ones by dotted path
+    ?include=bookable_room                               nest these relationships in full
+
+fields on its own drops every nested object it does not name, include on its own adds relationships to
+the plain (non nested) fields.  The same selection picks the loader options, so relationships that are
+not serialized are not loaded either: many-to-one relationships that are dumped are joinedloaded,
+collections are selectinloaded and everything else raises.  Without either parameter the endpoint's own
+loader options are used.
+"""
+from flask import request
+from marshmallow import class_registry, fields as ma_fields
+from sqlalchemy.orm import joinedload, raiseload, selectinload
+
+
+def _nested_schema_class(field):
+    if isinstance(field.nested, str):
+        return class_registry.get_class(field.nested)
+    return field.nested
+
+
+def _split(argument):
+    return [name.strip() for name in request.args.get(argument, '').split(',') if name.strip()]
+
+
+def _check_names(schema_class, names):
+    """ Raise ValueError naming the first field path schema_class does not declare """
+    for name in names:
+        head, _, rest = name.partition('.')
+        field = schema_class._declared_fields.get(head)
+        if field is None or (rest and not isinstance(field, ma_fields.Nested)):
+            raise ValueError('unknown field: %s' % name)
+        if rest:
+            _check_names(_nested_schema_class(field), [rest])
+
+
+def _relationship_paths(model, schema_class, only):
+    """ The relationship attributes to load, as chains from model, for dumping only """
+    nested = {}
+    for name in only:
+        head, _, rest = name.partition('.')
+        field = schema_class._declared_fields[head]
+        if isinstance(field, ma_fields.Nested):
+            if not rest:
+                nested[head] = None
+            elif nested.get(head, ()) is not None:
+                nested.setdefault(head, []).append(rest)
+
+    paths = []
+    for head, nested_only in nested.items():
+        relationship = getattr(model, head)
+        nested_schema_class = _nested_schema_class(schema_class._declared_fields[head])
+        if nested_only is None:
+            nested_only = list(nested_schema_class._declared_fields)
+        paths.append([relationship])
+        paths.extend([relationship] + path for path in
+                     _relationship_paths(relationship.property.mapper.class_, nested_schema_class, nested_only))
+    return paths
+
+
+def _load(loader, relationship):
+    """ loader chained with the eager load for relationship, a join for one row or a second select for many """
+    if relationship.property.uselist:
+        return loader.selectinload(relationship) if loader is not None else selectinload(relationship)
+    return loader.joinedload(relationship) if loader is not None else joinedload(relationship)
+
+
+def fieldset(model, schema_class, default_options):
+    """ The schema and loader options for the requested ?fields= and ?include=, or the full schema and
+        the endpoint's options when neither is given.  Raises ValueError for a field the schema does not have """
+    selected = _split('fields')
+    included = _split('include')
+    if not selected and not included:
+        return schema_class(), list(default_options)
+    _check_names(schema_class, selected + included)
+    if not selected:
+        selected = [name for name, field in schema_class._declared_fields.items()
+                    if not isinstance(field, ma_fields.Nested)]
+    only = selected + [name for name in included if name not in selected]
+
+    options = [raiseload('*')]
+    for path in _relationship_paths(model, schema_class, only):
+        loader = None
+        for relationship in path:
+            loader = _load(loader, relationship)
+        options.append(loader.raiseload('*'))
+    return schema_class(only=only), options
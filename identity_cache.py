@@ -0,0 +1,64 @@
+"""
+Owner identity cache.
+
+Maps an owner email to the owner's id and name and the email's access level, so Google logins and the
+point counts by email resolve the owner from memory instead of joining owner to owner_email on every
+request.  Emails no owner has are cached too, as None.
+
+The cache is an LRU of at most IDENTITY_CACHE_SIZE emails whose entries expire after
+IDENTITY_CACHE_TTL seconds, which bounds how long a change made by another worker goes unseen.  This
+worker's owner and owner email writes (views_owner.py) clear it.
+"""
+import threading
+from collections import namedtuple
+
+from cachetools import TTLCache
+from flask import current_app
+
+from models import db, Owner, OwnerEmail
+
+OwnerIdentity = namedtuple('OwnerIdentity', ['owner_id', 'name', 'access_level'])
+
+_MISSING = object()
+
+
+class IdentityCache:
+    def __init__(self):
+        # TTLCache is not thread safe
+        self._lock = threading.Lock()
+        self._identities = None
+        self._generation = 0
+
+    def _cache(self):
+        if self._identities is None:
+            self._identities = TTLCache(maxsize=current_app.config.get('IDENTITY_CACHE_SIZE', 1024),
+                                        ttl=current_app.config.get('IDENTITY_CACHE_TTL', 300))
+        return self._identities
+
+    def get(self, owner_email):
+        """ The OwnerIdentity of an email, or None when no owner has it """
+        with self._lock:
+            identity = self._cache().get(owner_email, _MISSING)
+            generation = self._generation
+        if identity is not _MISSING:
+            return identity
+        row = db.session.query(OwnerEmail.owner_id, Owner.name, OwnerEmail.access_level).\
+            join(Owner, Owner.id == OwnerEmail.owner_id).\
+            filter(OwnerEmail.owner_email == owner_email).\
+            first()
+        identity = OwnerIdentity(*row) if row is not None else None
+        with self._lock:
+            # not when a write cleared the cache while the row was read, it may be the old one
+            if generation == self._generation:
+                self._cache()[owner_email] = identity
+        return identity
+
+    def invalidate(self):
+        """ Forget every email, after a write to an owner or owner email """
+        with self._lock:
+            self._generation += 1
+            if self._identities is not None:
+                self._identities.clear()
+
+
+identity_cache = IdentityCache()
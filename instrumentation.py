@@ -0,0 +1,115 @@
+"""
+Per request SQL instrumentation.
+
+A sampled share of requests (INSTRUMENT_SAMPLE_RATE in config.py, 0 switches it off) counts the SQL
+statements it runs, the rows they return and the time spent in the database, in serialization (schema
+dumps and JSON encoding) and in total.  The figures go back to the client as a Server-Timing header,
+which browser dev tools show next to the request:
+    Server-Timing: db;desc="7 statements, 140 rows";dur=12.31, serialize;dur=4.07, app;dur=3.90, total;dur=20.28
+and are printed as one JSON log line per request, which App Engine logging picks up as structured fields.
+
+Rows are what the driver reports when a statement runs: psycopg2 counts the rows of a SELECT, SQLite
+and server side cursors (?stream=true) report none.  A streamed response is timed up to the point its
+body starts.
+"""
+import json
+import random
+import time
+from contextlib import contextmanager
+
+from flask import current_app, g, has_request_context, request
+from flask_restful.representations.json import output_json
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+class RequestStats:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.statements = 0
+        self.rows = 0
+        self.db_seconds = 0.0
+        self.serialize_seconds = 0.0
+        self.serialize_depth = 0
+
+
+def current_stats():
+    """ The stats of the current request, or None outside a request or when it was not sampled """
+    if not has_request_context():
+        return None
+    return g.get('request_stats')
+
+
+@contextmanager
+def serializing():
+    """ Count the enclosed block as serialization time, nested dumps only once """
+    stats = current_stats()
+    if stats is None:
+        yield
+        return
+    stats.serialize_depth += 1
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.serialize_depth -= 1
+        if not stats.serialize_depth:
+            stats.serialize_seconds += time.perf_counter() - started
+
+
+def timed_output_json(data, code, headers=None):
+    """ flask-restful's JSON representation, with the encoding counted as serialization """
+    with serializing():
+        return output_json(data, code, headers)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None and current_stats() is not None:
+        context.instrument_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = current_stats()
+    started = getattr(context, 'instrument_started', None)
+    if stats is None or started is None:
+        return
+    stats.db_seconds += time.perf_counter() - started
+    stats.statements += 1
+    if cursor.description is not None and cursor.rowcount > 0:
+        stats.rows += cursor.rowcount
+
+
+def start_request():
+    if random.random() < current_app.config.get('INSTRUMENT_SAMPLE_RATE', 0):
+        g.request_stats = RequestStats()
+
+
+def server_timing(stats, total_seconds):
+    app_seconds = max(total_seconds - stats.db_seconds - stats.serialize_seconds, 0)
+    return 'db;desc="%s statements, %s rows";dur=%.2f, serialize;dur=%.2f, app;dur=%.2f, total;dur=%.2f' % (
+        stats.statements, stats.rows, stats.db_seconds * 1000, stats.serialize_seconds * 1000,
+        app_seconds * 1000, total_seconds * 1000)
+
+
+def finish_request(response):
+    stats = current_stats()
+    if stats is None:
+        return response
+    total_seconds = time.perf_counter() - stats.started
+    response.headers['Server-Timing'] = server_timing(stats, total_seconds)
+    print(json.dumps({'message': 'REQUEST TIMING - %s %s %s' % (request.method, request.path, response.status_code),
+                      'endpoint': request.endpoint,
+                      'statements': stats.statements,
+                      'rows': stats.rows,
+                      'db_ms': round(stats.db_seconds * 1000, 2),
+                      'serialize_ms': round(stats.serialize_seconds * 1000, 2),
+                      'total_ms': round(total_seconds * 1000, 2)}))
+    return response
+
+
+def init_instrumentation(app):
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+    app.before_request(start_request)
+    app.after_request(finish_request)
@@ -1,16 +1,42 @@
 from flask import Flask
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager
+from sqlalchemy.exc import SQLAlchemyError
 
 import gcp_auth
 from models import db
 from views import api_bp
+from availability import availability_index
+from compression import init_compression
+from instrumentation import init_instrumentation
+from nplusone import init_nplusone
+from reference_data import reference_data
 
 app = Flask(__name__)
 app.config.from_object('config')
 CORS(app)
 db.init_app(app)
 app.register_blueprint(api_bp, url_prefix='/api')
+# after_request handlers run last registered first, so the request timings include the compression
+init_instrumentation(app)
+init_nplusone(app)
+init_compression(app)
+
+if app.config['AVAILABILITY_INDEX']:
+    with app.app_context():
+        try:
+            availability_index.load()
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            app.logger.warning('AVAILABILITY INDEX - not preloaded, counting in the database until it loads: %s', e)
+    availability_index.start_checks(app)
+
+with app.app_context():
+    try:
+        reference_data.load()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        app.logger.warning('REFERENCE DATA - not preloaded, loading on first use: %s', e)
 
 
 app.config['JWT_SECRET_KEY'] = gcp_auth.token_secret
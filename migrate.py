@@ -1,7 +1,8 @@
 from flask_script import Manager
 from flask_migrate import Migrate, MigrateCommand
-from models import db
+from models import db, ActualPoint, PersonalPoint
 from main import app
+import point_ranges
 
 
 migrate = Migrate(app, db)
@@ -9,5 +10,23 @@ manager = Manager(app)
 manager.add_command('db', MigrateCommand)
 
 
+@manager.command
+def compress_points():
+    """ Add ranges for the per point rows no range holds yet, for POINT_STORAGE = 'ranges' """
+    for model in (ActualPoint, PersonalPoint):
+        range_count = point_ranges.compress_points(model)
+        print('%s: %s ranges added' % (point_ranges.RANGE_MODELS[model].__tablename__, range_count))
+    db.session.commit()
+
+
+@manager.command
+def expand_points():
+    """ Write the point ranges back to the per point tables and empty them, for POINT_STORAGE = 'rows' """
+    for model in (ActualPoint, PersonalPoint):
+        point_count = point_ranges.expand_points(model)
+        print('%s: %s points updated' % (model.__tablename__, point_count))
+    db.session.commit()
+
+
 if __name__ == '__main__':
     manager.run()
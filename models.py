@@ -2,10 +2,15 @@ from marshmallow import fields, pre_load
 from marshmallow import validate
 from flask_sqlalchemy import SQLAlchemy
 from flask_marshmallow import Marshmallow
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.sql import func
 import datetime
 import gcp_auth
 import jwt
+from instrumentation import serializing
 
 
 db = SQLAlchemy()
@@ -25,24 +30,27 @@ class AddUpdateDelete:
         return db.session.commit()
 
 
-def log_event(jwt_identity, description):
-    """ Add an event directly to the db and commit"""
+def log_event(jwt_identity, description, commit=True):
+    """ Add an event directly to the db and commit, unless the caller commits it with other work"""
     new_event = EventLog()
     new_event.google_id = jwt_identity
     new_event.description = description
     db.session.add(new_event)
-    return db.session.commit()
+    if commit:
+        return db.session.commit()
 
 
+# relationships load lazily, each resource declares the loader options for what it dumps next to it
+# (the *_LOADER_OPTIONS in the views modules), so a row never drags in the history joined to it
 class Owner(db.Model, AddUpdateDelete):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(255), unique=True)
     email = db.relationship('OwnerEmail', backref=db.backref(
-        'owner', lazy='joined'), lazy='joined')
+        'owner', lazy='select'), lazy='select')
     person_points = db.relationship(
         'PersonalPoint', backref='owner', lazy='select')
     trips = db.relationship('Trip', backref=db.backref(
-        'owner', lazy='joined'), lazy='select')
+        'owner', lazy='select'), lazy='select')
 
     def __init__(self, name):
         self.name = name
@@ -71,7 +79,7 @@ class Resort(db.Model, AddUpdateDelete):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(255), unique=True, nullable=False)
     bookable_rooms = db.relationship('BookableRoom', backref=db.backref(
-        'resort', lazy='joined'), lazy='joined')
+        'resort', lazy='select'), lazy='select')
 
     def __init__(self, name):
         self.name = name
@@ -85,7 +93,7 @@ class RoomType(db.Model, AddUpdateDelete):
     name = db.Column(db.String(255), unique=True, nullable=False)
     sleeps = db.Column(db.Integer, nullable=True)
     bookable_rooms = db.relationship('BookableRoom', backref=db.backref(
-        'room_type', lazy='joined'), lazy='joined')
+        'room_type', lazy='select'), lazy='select')
 
     def __init__(self, name, **kwargs):
         self.name = name
@@ -103,7 +111,7 @@ class BookableRoom(db.Model, AddUpdateDelete):
     room_type_id = db.Column(db.Integer, db.ForeignKey(
         'room_type.id'), nullable=False)
     trips = db.relationship('Trip', backref=db.backref(
-        'bookable_room', lazy='joined'), lazy='joined')
+        'bookable_room', lazy='select'), lazy='select')
 
     def __init__(self, resort, room_type):
         self.resort = resort
@@ -121,6 +129,13 @@ class ActualPoint(db.Model, AddUpdateDelete):
     trip_id = db.Column(db.Integer, db.ForeignKey('trip.id'))
     banked_date = db.Column(db.DateTime)
 
+    # unallocated points are always searched by use year window and banked state, in point order
+    __table_args__ = (
+        db.Index('ix_actual_point_available', 'use_year', 'point_number', 'banked_date',
+                 postgresql_where=db.text('trip_id IS NULL')),
+        db.Index('ix_actual_point_trip_id', 'trip_id'),
+    )
+
     def __init__(self, use_year, point_number):
         self.use_year = use_year
         self.point_number = point_number
@@ -138,6 +153,13 @@ class PersonalPoint(db.Model, AddUpdateDelete):
         'owner.id'), primary_key=True)
     trip_id = db.Column(db.Integer, db.ForeignKey('trip.id'))
 
+    # unallocated points are always searched per owner by use year window, in point order
+    __table_args__ = (
+        db.Index('ix_personal_point_available', 'owner_id', 'use_year', 'point_number',
+                 postgresql_where=db.text('trip_id IS NULL')),
+        db.Index('ix_personal_point_trip_id', 'trip_id'),
+    )
+
     def __init__(self, use_year, point_number, owner_id):
         self.use_year = use_year
         self.point_number = point_number
@@ -147,6 +169,77 @@ class PersonalPoint(db.Model, AddUpdateDelete):
         return "Person point %s-%s-%s - ID(%s)" % (self.use_year, self.point_number, self.owner.name, self.id)
 
 
+class PointRange:
+    """ A contiguous run of points, start_point_number to end_point_number inclusive, that share
+        every other column.  Used by the range compressed point storage in point_ranges.py """
+
+    @property
+    def size(self):
+        return self.end_point_number - self.start_point_number + 1
+
+    def split(self, point_count):
+        """ Shrink this range to its first point_count points and return a new range holding the rest """
+        remainder = self.__class__(self.use_year, self.start_point_number + point_count, self.end_point_number)
+        for column in self.range_key_columns:
+            setattr(remainder, column, getattr(self, column))
+        self.end_point_number = self.start_point_number + point_count - 1
+        return remainder
+
+
+class ActualPointRange(db.Model, AddUpdateDelete, PointRange):
+    id = db.Column(db.Integer, primary_key=True)
+    use_year = db.Column(db.DateTime, nullable=False)
+    start_point_number = db.Column(db.Integer, nullable=False)
+    end_point_number = db.Column(db.Integer, nullable=False)
+    trip_id = db.Column(db.Integer, db.ForeignKey('trip.id'))
+    banked_date = db.Column(db.DateTime)
+
+    # columns that must match for two neighbouring ranges to be one run
+    range_key_columns = ('use_year', 'trip_id', 'banked_date')
+
+    __table_args__ = (
+        db.Index('ix_actual_point_range_available', 'use_year', 'start_point_number', 'banked_date',
+                 postgresql_where=db.text('trip_id IS NULL')),
+        db.Index('ix_actual_point_range_trip_id', 'trip_id'),
+    )
+
+    def __init__(self, use_year, start_point_number, end_point_number):
+        self.use_year = use_year
+        self.start_point_number = start_point_number
+        self.end_point_number = end_point_number
+
+    def __repr__(self):
+        return "Actual points %s-%s:%s - ID(%s)" % (self.use_year, self.start_point_number,
+                                                    self.end_point_number, self.id)
+
+
+class PersonalPointRange(db.Model, AddUpdateDelete, PointRange):
+    id = db.Column(db.Integer, primary_key=True)
+    use_year = db.Column(db.DateTime, nullable=False)
+    start_point_number = db.Column(db.Integer, nullable=False)
+    end_point_number = db.Column(db.Integer, nullable=False)
+    owner_id = db.Column(db.Integer, db.ForeignKey('owner.id'), nullable=False)
+    trip_id = db.Column(db.Integer, db.ForeignKey('trip.id'))
+
+    # columns that must match for two neighbouring ranges to be one run
+    range_key_columns = ('owner_id', 'use_year', 'trip_id')
+
+    __table_args__ = (
+        db.Index('ix_personal_point_range_available', 'owner_id', 'use_year', 'start_point_number',
+                 postgresql_where=db.text('trip_id IS NULL')),
+        db.Index('ix_personal_point_range_trip_id', 'trip_id'),
+    )
+
+    def __init__(self, use_year, start_point_number, end_point_number):
+        self.use_year = use_year
+        self.start_point_number = start_point_number
+        self.end_point_number = end_point_number
+
+    def __repr__(self):
+        return "Person points %s-%s:%s-%s - ID(%s)" % (self.use_year, self.start_point_number,
+                                                       self.end_point_number, self.owner_id, self.id)
+
+
 class Trip(db.Model, AddUpdateDelete):
     id = db.Column(db.Integer, primary_key=True)
     check_in_date = db.Column(db.DateTime, nullable=False)
@@ -177,6 +270,85 @@ class EventLog(db.Model, AddUpdateDelete):
     description = db.Column(db.String(4095), nullable=False)
 
 
+class TableVersion(db.Model):
+    """ Change counter of a table, bumped in a short transaction of its own after every commit that
+        changed the table.  Drives the ETags of the list and detail resources (see conditional_get in
+        dvc_decorators.py) """
+    table_name = db.Column(db.String(64), primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+
+
+# the tables clients poll; the point tables change on every booking and are left out
+VERSIONED_TABLES = ('owner', 'owner_email', 'resort', 'room_type', 'bookable_room', 'trip')
+
+
+def bump_table_versions(connection, table_names):
+    table = TableVersion.__table__
+    for table_name in sorted(table_names):
+        if connection.dialect.name == 'postgresql':
+            insert = postgresql.insert(table).values(table_name=table_name, version=1)
+            connection.execute(insert.on_conflict_do_update(index_elements=[table.c.table_name],
+                                                            set_={'version': table.c.version + 1}))
+        else:
+            result = connection.execute(table.update().
+                                        where(table.c.table_name == table_name).
+                                        values(version=table.c.version + 1))
+            if result.rowcount == 0:
+                connection.execute(table.insert().values(table_name=table_name, version=1))
+
+
+def table_versions(table_names):
+    """ The counters of table_names, in order, or None when they cannot be read (before the table_version
+        table is migrated, say).  Read on a connection of their own, so a failure leaves the request's
+        transaction usable """
+    table = TableVersion.__table__
+    try:
+        with db.engine.connect() as connection:
+            versions = dict(connection.execute(db.select([table.c.table_name, table.c.version]).
+                                               where(table.c.table_name.in_(table_names))).fetchall())
+    except SQLAlchemyError as e:
+        current_app.logger.error('TABLE VERSION - counters unreadable: %s', e)
+        return None
+    return [versions.get(table_name, 0) for table_name in table_names]
+
+
+@event.listens_for(db.session, 'after_flush')
+def record_flushed_tables(session, flush_context):
+    """ Note the versioned tables this flush inserted, updated or deleted rows of """
+    changed = session.info.setdefault('changed_tables', set())
+    for instance in list(session.new) + list(session.dirty) + list(session.deleted):
+        table_name = getattr(instance, '__tablename__', None)
+        if table_name in VERSIONED_TABLES and \
+                (instance not in session.dirty or session.is_modified(instance, include_collections=False)):
+            changed.add(table_name)
+
+
+@event.listens_for(db.session, 'after_commit')
+def bump_committed_table_versions(session):
+    """ Bump the counters of the tables the commit changed, in a transaction of its own, so the counter
+        rows are never locked for the length of a booking.  A reader between the two commits sees the new
+        rows with the old counters, which only costs its client one more refetch.  A savepoint commit
+        waits for its transaction, as bumping then would let readers cache rows that are not visible yet """
+    if session.transaction.nested:
+        return
+    changed = session.info.pop('changed_tables', None)
+    if not changed:
+        return
+    try:
+        with session.get_bind().begin() as connection:
+            bump_table_versions(connection, changed)
+    except SQLAlchemyError as e:
+        current_app.logger.error('TABLE VERSION - %s not bumped: %s', ', '.join(sorted(changed)), e)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def forget_rolled_back_tables(session):
+    # a savepoint rollback keeps the tables the rest of the transaction changed, bumping one too many is
+    # harmless
+    if not session.transaction.nested:
+        session.info.pop('changed_tables', None)
+
+
 class TokenUser(db.Model, AddUpdateDelete):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(45), nullable=False)
@@ -222,7 +394,18 @@ class TokenUser(db.Model, AddUpdateDelete):
             return 'Invalid token. Please log in again.'
 
 
-class OwnerSchema(ma.Schema):
+# create the backrefs now, the views declare their loader options on them at import
+db.configure_mappers()
+
+
+class TimedSchema(ma.Schema):
+    """ Counts its dumps as serialization time in the request timings (see instrumentation.py) """
+    def dump(self, obj, *, many=None):
+        with serializing():
+            return super().dump(obj, many=many)
+
+
+class OwnerSchema(TimedSchema):
     id = fields.Integer(dump_only=True)
     url = ma.URLFor('api.ownerresource', id='<id>', _external=True)
     name = fields.String(required=True, validate=validate.Length(3))
@@ -230,7 +413,7 @@ class OwnerSchema(ma.Schema):
     # email = fields.Nested('OwnerEmailSchema', many=True, exclude=('owner',))
 
 
-class OwnerEmailSchema(ma.Schema):
+class OwnerEmailSchema(TimedSchema):
     id = fields.Integer(dump_only=True)
     url = ma.URLFor('api.owneremailresource', id='<id>', _external=True)
     owner_email = fields.String(required=True, validate=validate.Email())
@@ -252,27 +435,27 @@ class OwnerEmailSchema(ma.Schema):
         return data
 
 
-class ResortSchema(ma.Schema):
+class ResortSchema(TimedSchema):
     id = fields.Integer(dump_only=False)
     url = ma.URLFor('api.resortresource', id='<id>', _external=True)
     name = fields.String(required=True, validate=validate.Length(3))
 
 
-class RoomTypeSchema(ma.Schema):
+class RoomTypeSchema(TimedSchema):
     id = fields.Integer(dump_only=False)
     url = ma.URLFor('api.roomtyperesource', id='<id>', _external=True)
     name = fields.String(required=True, validate=validate.Length(3))
     sleeps = fields.Integer(allow_none=True)
 
 
-class BookableRoomSchema(ma.Schema):
+class BookableRoomSchema(TimedSchema):
     id = fields.Integer(dump_only=True)
     url = ma.URLFor('api.bookableroomresource', id='<id>', _external=True)
     resort = fields.Nested('ResortSchema', required=True)
     room_type = fields.Nested('RoomTypeSchema', required=True)
 
 
-class ActualPointScheme(ma.Schema):
+class ActualPointScheme(TimedSchema):
     id = fields.Integer(dump_only=True)
     url = ma.URLFor('api.actualpointresource', id='<id>', _external=True)
     use_year = fields.DateTime(required=True)
@@ -281,7 +464,7 @@ class ActualPointScheme(ma.Schema):
     banked_date = fields.DateTime()
 
 
-class PersonalPointSchema(ma.Schema):
+class PersonalPointSchema(TimedSchema):
     id = fields.Integer(dump_only=True)
     url = ma.URLFor('api.personalpointresource', id='<id>', _external=True)
     use_year = fields.DateTime(required=True)
@@ -290,7 +473,7 @@ class PersonalPointSchema(ma.Schema):
     trip_id = fields.Integer()
 
 
-class TripSchema(ma.Schema):
+class TripSchema(TimedSchema):
     id = fields.Integer(dump_only=True)
     url = ma.URLFor('api.tripresource', trip_id='<id>', _external=True)
     check_in_date = fields.DateTime(required=True)
@@ -303,7 +486,7 @@ class TripSchema(ma.Schema):
         required=True, validate=validate.Range(min=1))
 
 
-class EventLogSchema(ma.Schema):
+class EventLogSchema(TimedSchema):
     id = fields.Integer(dump_only=True)
     url = ma.URLFor('api.eventlogresource', id='<id>', _external=True)
     timestamp = fields.DateTime(dump_only=True)
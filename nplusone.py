@@ -0,0 +1,120 @@
+"""
+N+1 query detection.
+
+With NPLUSONE_MODE set in config.py every request keeps the SELECT statements it runs, and a statement
+that runs with NPLUSONE_THRESHOLD or more different sets of parameters is reported when the request
+finishes.  The report names the resource method, the relationship that was lazy loaded (when it was a
+lazy load) and the line of app code that triggered it:
+    N+1 QUERY - TripListResource.get ran a SELECT with 25 different parameters: lazy load of Owner.email
+        from fast_serializers.py:58 in _get
+        SELECT owner_email.id AS owner_email_id, ... WHERE ? = owner_email.owner_id
+
+'warn' prints the report and issues an NPlusOneWarning, for staging.  'raise' raises NPlusOneError
+from the request instead, so the request fails in a test client.  None, the default, switches
+detection off.  Statements run while a streamed response (?stream=true) is being sent are not checked.
+"""
+import os
+import sys
+import warnings
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm.strategies import LazyLoader
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+MAX_STATEMENT_LENGTH = 300
+
+
+class NPlusOneError(Exception):
+    pass
+
+
+class NPlusOneWarning(UserWarning):
+    pass
+
+
+class RepeatedSelect:
+    def __init__(self):
+        self.parameters = set()
+        self.relationship = None
+        self.location = None
+
+
+def _call_site():
+    """ The lazy loaded relationship and the innermost line of app code running the current statement """
+    relationship = None
+    location = None
+    frame = sys._getframe(2)
+    while frame is not None and (relationship is None or location is None):
+        loader = frame.f_locals.get('self')
+        filename = frame.f_code.co_filename
+        if relationship is None and isinstance(loader, LazyLoader):
+            relationship = str(loader.parent_property)
+        elif location is None and filename.startswith(APP_DIR) and 'site-packages' not in filename \
+                and filename != __file__:
+            location = '%s:%s in %s' % (os.path.relpath(filename, APP_DIR), frame.f_lineno, frame.f_code.co_name)
+        frame = frame.f_back
+    return relationship, location
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if not has_request_context() or cursor.description is None:
+        return
+    selects = g.get('nplusone_selects')
+    if selects is None:
+        return
+    select = selects.get(statement)
+    if select is None:
+        select = selects[statement] = RepeatedSelect()
+    select.parameters.add(repr(parameters))
+    # the first statement could be a one off, only a repeat is worth walking the stack for
+    if len(select.parameters) == 2:
+        select.relationship, select.location = _call_site()
+
+
+def _resource_method():
+    view_class = getattr(current_app.view_functions.get(request.endpoint), 'view_class', None)
+    if view_class is None:
+        return '%s %s' % (request.method, request.path)
+    return '%s.%s' % (view_class.__name__, request.method.lower())
+
+
+def repeated_selects_report(selects, threshold):
+    """ One report line per statement run with threshold or more different parameters, or None """
+    reports = []
+    for statement, select in selects.items():
+        if len(select.parameters) < threshold:
+            continue
+        cause = 'lazy load of %s' % select.relationship if select.relationship else 'repeated select'
+        if select.location:
+            cause += ' from %s' % select.location
+        reports.append('N+1 QUERY - %s ran a SELECT with %s different parameters: %s\n    %s' % (
+            _resource_method(), len(select.parameters), cause, ' '.join(statement.split())[:MAX_STATEMENT_LENGTH]))
+    return '\n'.join(reports) or None
+
+
+def start_request():
+    if current_app.config.get('NPLUSONE_MODE'):
+        g.nplusone_selects = {}
+
+
+def check_request(response):
+    selects = g.get('nplusone_selects')
+    if not selects:
+        return response
+    report = repeated_selects_report(selects, current_app.config.get('NPLUSONE_THRESHOLD', 3))
+    if report is None:
+        return response
+    if current_app.config['NPLUSONE_MODE'] == 'raise':
+        raise NPlusOneError(report)
+    print(report)
+    warnings.warn(report, NPlusOneWarning)
+    return response
+
+
+def init_nplusone(app):
+    if not event.contains(Engine, 'after_cursor_execute', _after_cursor_execute):
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+    app.before_request(start_request)
+    app.after_request(check_request)
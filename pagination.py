@@ -0,0 +1,61 @@
+"""
+Keyset pagination for the list endpoints.
+
+A list endpoint pages when the request carries a limit or a cursor, e.g. /api/trips/?limit=100, and
+otherwise returns the whole collection as before.  Pages are ordered by an indexed, unique key column
+and the cursor encodes the last key of the previous page, so each page is a single
+WHERE key > :cursor ORDER BY key LIMIT :limit range scan and deep pages cost the same as the first.
+Unlike the offset paginate() of /events/, rows added or removed while paging never shift later pages.
+"""
+import base64
+import binascii
+
+from flask import request
+import status
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+
+def pagination_requested():
+    return 'limit' in request.args or 'cursor' in request.args
+
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(str(key).encode()).decode()
+
+
+def decode_cursor(cursor):
+    return int(base64.urlsafe_b64decode(cursor.encode()).decode())
+
+
+def keyset_rows(query, key_column):
+    """ The rows of the requested page of query ordered by key_column, the limit and the next cursor.
+        Raises ValueError for a cursor this module did not hand out """
+    limit = min(max(request.args.get('limit', DEFAULT_LIMIT, type=int), 1), MAX_LIMIT)
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            query = query.filter(key_column > decode_cursor(cursor))
+        except (binascii.Error, UnicodeDecodeError, ValueError):
+            raise ValueError('invalid cursor')
+
+    # one row past the page tells whether there is a next page without a COUNT
+    rows = query.order_by(key_column).limit(limit + 1).all()
+    page = rows[:limit]
+    next_cursor = None
+    if len(rows) > limit:
+        next_cursor = encode_cursor(getattr(page[-1], key_column.key))
+    return page, limit, next_cursor
+
+
+def keyset_page(query, key_column, schema):
+    """ One page of query ordered by key_column, dumped with schema, or a 400 for a bad cursor """
+    try:
+        page, limit, next_cursor = keyset_rows(query, key_column)
+    except ValueError as e:
+        resp = {'message': str(e)}
+        return resp, status.HTTP_400_BAD_REQUEST
+    return {'items': schema.dump(page, many=True),
+            'limit': limit,
+            'next_cursor': next_cursor}
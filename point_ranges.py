@@ -0,0 +1,287 @@
+"""
+Range compressed point storage.
+
+Instead of one row per point, ActualPointRange and PersonalPointRange store every contiguous run of
+points that share a use year, trip and banked date (or owner) as a single row.  Counting sums range
+sizes, and allocating or banking part of a range splits it in two.
+
+Storage is picked with POINT_STORAGE in config.py, 'rows' (the default) or 'ranges'.  Before switching
+to 'ranges', fill the range tables from the per point tables with:
+    python migrate.py compress_points
+Running it again only adds ranges for points that no range holds yet, such as a new use year's, so
+allocations and banks made under range storage are kept.  Before switching back to 'rows', write the
+ranges back to the per point tables and empty the range tables with:
+    python migrate.py expand_points
+The per point rows stay, as the ids and numbers of the points: the point endpoints read them through
+point_rows(), which takes each point's trip and banked date from the range holding it.
+"""
+from flask import current_app
+from sqlalchemy import and_, case, exists, func
+from sqlalchemy.orm import aliased
+from models import db, ActualPoint, ActualPointRange, PersonalPoint, PersonalPointRange
+
+RANGE_MODELS = {ActualPoint: ActualPointRange,
+                PersonalPoint: PersonalPointRange}
+
+# ranges locked per statement while claiming points
+CLAIM_BATCH_SIZE = 20
+# the columns a point takes from the range holding it, under range storage
+RANGE_VALUE_COLUMNS = ('trip_id', 'banked_date')
+
+_expanded_points = {}
+
+
+def ranges_enabled():
+    return current_app.config.get('POINT_STORAGE', 'rows') == 'ranges'
+
+
+def point_model(model):
+    """ The model that stores the points of ActualPoint or PersonalPoint in the configured storage """
+    if ranges_enabled():
+        return RANGE_MODELS[model]
+    return model
+
+
+def is_range_model(model):
+    return model in RANGE_MODELS.values()
+
+
+def _holds_point(model):
+    """ Criterion matching the rows of the range table of model to the per point rows they hold """
+    range_model = RANGE_MODELS[model]
+    points = model.__table__
+    point_ranges = range_model.__table__
+    holds_point = [point_ranges.c[column] == points.c[column] for column in range_model.range_key_columns
+                   if column not in RANGE_VALUE_COLUMNS]
+    holds_point.append(points.c.point_number.between(point_ranges.c.start_point_number,
+                                                     point_ranges.c.end_point_number))
+    return and_(*holds_point)
+
+
+def _expand_ranges(model):
+    """ model mapped onto its per point rows joined to the range holding each point, with the
+        RANGE_VALUE_COLUMNS read from the range """
+    points = model.__table__
+    point_ranges = RANGE_MODELS[model].__table__
+    columns = [point_ranges.c[column.name].label(column.name) if column.name in RANGE_VALUE_COLUMNS
+               else column for column in points.c]
+    rows = db.select(columns).select_from(points.join(point_ranges, _holds_point(model)))
+    return aliased(model, rows.alias('expanded_' + points.name), adapt_on_names=True)
+
+
+def point_rows(model):
+    """ What the point endpoints query for the points of ActualPoint or PersonalPoint: the model itself,
+        or under range storage the model mapped onto the ranges, so ids, urls, paging and loader options
+        work unchanged.  Read only """
+    if not ranges_enabled():
+        return model
+    expanded = _expanded_points.get(model)
+    if expanded is None:
+        expanded = _expanded_points[model] = _expand_ranges(model)
+    return expanded
+
+
+def point_total(model, *criteria):
+    """ Aggregate counting the points held by the rows of model that match every criterion """
+    if is_range_model(model):
+        size = model.end_point_number - model.start_point_number + 1
+        if criteria:
+            size = case([(and_(*criteria), size)], else_=0)
+        return func.coalesce(func.sum(size), 0)
+    if criteria:
+        return func.count(case([(and_(*criteria), 1)]))
+    return func.count(model.id)
+
+
+def _lock_ranges(model, criteria, skip_locked):
+    return db.session.query(model)\
+        .filter(*criteria)\
+        .order_by(model.use_year, model.start_point_number)\
+        .limit(CLAIM_BATCH_SIZE)\
+        .with_for_update(skip_locked=skip_locked)\
+        .all()
+
+
+def point_count(model, rows):
+    """ How many points the rows of either point storage hold """
+    if is_range_model(model):
+        return sum(row.size for row in rows)
+    return len(rows)
+
+
+def claim_range_points(model, values, points_needed, *criteria):
+    """ Set values on the first points_needed points matching criteria, lowest use year and point
+        number first, splitting the last range when only part of it is needed.  values must make a
+        claimed range stop matching criteria.
+        Ranges are locked CLAIM_BATCH_SIZE at a time, skipping those a concurrent claim holds.  When
+        that finds too few and this claim holds none yet, it waits for the first locked range instead,
+        as the other claim usually leaves part of it free, so two bookings of the last free range do
+        not report a shortage.  Returns the claimed ranges """
+    claimed_ranges = []
+    if points_needed <= 0:
+        return claimed_ranges
+    claimed = 0
+    waited = False
+    while claimed < points_needed:
+        point_ranges = _lock_ranges(model, criteria, skip_locked=True)
+        if not point_ranges:
+            # waiting while holding ranges could deadlock with a claim waiting on them
+            if waited or claimed:
+                break
+            waited = True
+            point_ranges = _lock_ranges(model, criteria, skip_locked=False)
+            if not point_ranges:
+                # a remainder split off while waiting is only seen by the next statement
+                continue
+        for point_range in point_ranges:
+            if point_range.size > points_needed - claimed:
+                db.session.add(point_range.split(points_needed - claimed))
+            for column, value in values.items():
+                setattr(point_range, column, value)
+            claimed_ranges.append(point_range)
+            claimed += point_range.size
+            if claimed == points_needed:
+                break
+        db.session.flush()
+    return claimed_ranges
+
+
+def _lock_points(model, criteria, limit, skip_locked):
+    return db.session.query(*model.__table__.c)\
+        .filter(*criteria)\
+        .order_by(model.use_year, model.point_number)\
+        .limit(limit)\
+        .with_for_update(skip_locked=skip_locked)\
+        .all()
+
+
+def claim_point_rows(model, values, points_needed, *criteria):
+    """ Set values on the first points_needed per point rows matching criteria, lowest use year and
+        point number first.  values must make a claimed row stop matching criteria.
+        Rows a concurrent claim holds are skipped.  When that leaves the claim short it waits once for
+        the rest, as the other claim may roll back and leave them free, so a point is never passed over
+        for a later bucket or reported short while its holder is still deciding.  Returns the claimed
+        rows, as they were before the claim """
+    claimed_points = []
+    if points_needed <= 0:
+        return claimed_points
+    for skip_locked in (True, False):
+        points = _lock_points(model, criteria, points_needed - len(claimed_points), skip_locked)
+        if points:
+            db.session.query(model)\
+                .filter(model.id.in_([point.id for point in points]))\
+                .update(values, synchronize_session=False)
+            claimed_points.extend(points)
+        if len(claimed_points) == points_needed:
+            break
+    return claimed_points
+
+
+def claim_points(model, values, points_needed, *criteria):
+    """ claim_range_points or claim_point_rows, whichever matches the storage of model """
+    if is_range_model(model):
+        return claim_range_points(model, values, points_needed, *criteria)
+    return claim_point_rows(model, values, points_needed, *criteria)
+
+
+def _unchanged(model, point_range):
+    """ The row of point_range, as long as its key columns still hold the values it was read with """
+    return db.session.query(model).filter(
+        model.id == point_range.id,
+        *[getattr(model, column).is_(None) if getattr(point_range, column) is None
+          else getattr(model, column) == getattr(point_range, column)
+          for column in model.range_key_columns])
+
+
+def _merge_run(model, point_ranges):
+    """ Merge the neighbours among free ranges sharing their key columns, ordered by start point number """
+    first = point_ranges[0]
+    end_point_number = first.end_point_number
+    for point_range in point_ranges[1:]:
+        if end_point_number + 1 == point_range.start_point_number \
+                and _unchanged(model, point_range).delete(synchronize_session=False):
+            end_point_number = point_range.end_point_number
+            continue
+        _extend(model, first, end_point_number)
+        first, end_point_number = point_range, point_range.end_point_number
+    _extend(model, first, end_point_number)
+
+
+def _extend(model, point_range, end_point_number):
+    if end_point_number != point_range.end_point_number:
+        _unchanged(model, point_range).update({model.end_point_number: end_point_number},
+                                              synchronize_session=False)
+
+
+def merge_free_ranges(model, use_years):
+    """ Join neighbouring unallocated ranges in the given use years back into single ranges.
+        The free ranges are locked first, skipping those a concurrent claim holds as they are about to
+        change, and every DELETE and UPDATE repeats the key columns the range was read with, so a range
+        that stopped being free is never merged """
+    if not use_years:
+        return
+    free_ranges = db.session.query(model)\
+        .filter(model.trip_id.is_(None), model.use_year.in_(use_years))\
+        .order_by(model.use_year, model.start_point_number)\
+        .with_for_update(skip_locked=True)\
+        .all()
+
+    runs = {}
+    for point_range in free_ranges:
+        runs.setdefault(tuple(getattr(point_range, column) for column in model.range_key_columns),
+                        []).append(point_range)
+    for point_ranges in runs.values():
+        _merge_run(model, point_ranges)
+
+
+def release_range_points(model, trip_id):
+    """ Return every point of a trip to the unallocated pool and return the ranges released, as they
+        were before merging """
+    released_ranges = db.session.query(model)\
+        .filter(model.trip_id == trip_id)\
+        .all()
+    db.session.query(model)\
+        .filter(model.trip_id == trip_id)\
+        .update({model.trip_id: None}, synchronize_session=False)
+    merge_free_ranges(model, sorted(set(point_range.use_year for point_range in released_ranges)))
+    return released_ranges
+
+
+def compress_points(model):
+    """ Add ranges to the range table of ActualPoint or PersonalPoint for the per point rows that no
+        range holds yet, and return how many were added.  Existing ranges are never changed, as under
+        range storage they hold the allocations and banks.
+        Consecutive point numbers with equal key columns share the same point_number - row_number()
+        value, so each run becomes one group """
+    range_model = RANGE_MODELS[model]
+    key_columns = [getattr(model, column) for column in range_model.range_key_columns]
+    run = (model.point_number - func.row_number().over(partition_by=key_columns,
+                                                       order_by=model.point_number)).label('run')
+    numbered_points = db.session.query(model.point_number, run, *key_columns)\
+        .filter(~exists().where(_holds_point(model)))\
+        .subquery()
+    run_key_columns = [numbered_points.c[column] for column in range_model.range_key_columns]
+    runs = db.session.query(func.min(numbered_points.c.point_number),
+                            func.max(numbered_points.c.point_number),
+                            *run_key_columns)\
+        .group_by(numbered_points.c.run, *run_key_columns)
+
+    return db.session.execute(range_model.__table__.insert().from_select(
+        ['start_point_number', 'end_point_number'] + list(range_model.range_key_columns),
+        runs.statement)).rowcount
+
+
+def expand_points(model):
+    """ Write the trip and banked date of every range of ActualPoint or PersonalPoint back to the per
+        point rows it holds, then empty the range table, reversing compress_points.  Returns how many
+        per point rows were updated """
+    range_model = RANGE_MODELS[model]
+    point_ranges = range_model.__table__
+    holds_point = _holds_point(model)
+    values = dict((column, db.select([point_ranges.c[column]]).where(holds_point).as_scalar())
+                  for column in RANGE_VALUE_COLUMNS if column in range_model.range_key_columns)
+    updated_count = db.session.execute(model.__table__.update()
+                                       .where(exists().where(holds_point))
+                                       .values(values)).rowcount
+    db.session.query(range_model).delete(synchronize_session=False)
+    return updated_count
@@ -0,0 +1,126 @@
+"""
+Booking what-if simulation.
+
+Answers "could this owner book N points at check in date X?" for many candidates at once without
+touching the point tables.  Unallocated points are read once into a snapshot of per use year totals,
+then the banked -> current -> borrow windows of allocate_trip_points in views_trips.py are summed
+for every candidate together with NumPy:  window totals come from a cumulative sum over the sorted
+use years, found with searchsorted, and only the banked actual points, whose bucket also depends on
+the booked date, are matched candidate by candidate.
+"""
+import numpy as np
+from dateutil.relativedelta import relativedelta
+
+from models import db, ActualPoint, PersonalPoint
+from point_ranges import point_model, point_total
+
+
+def _dates(values):
+    return np.array(values, dtype='datetime64[us]')
+
+
+def _window_totals(use_years, totals, after, before):
+    """ Points with after < use_year < before, for every (after, before) pair.
+        use_years must be sorted and totals is the running total of their point counts """
+    return totals[np.searchsorted(use_years, before, side='left')] - \
+        totals[np.searchsorted(use_years, after, side='right')]
+
+
+def _running_totals(point_counts):
+    return np.concatenate(([0], np.cumsum(point_counts, dtype=np.int64)))
+
+
+def _allocate(points_needed, buckets):
+    """ Split points_needed over the buckets in order, as allocate_points does one bucket at a time.
+        Returns the allocated count per bucket and the shortage """
+    allocated = []
+    remaining = points_needed
+    for bucket in buckets:
+        taken = np.minimum(remaining, bucket)
+        allocated.append(taken)
+        remaining = remaining - taken
+    return allocated, remaining
+
+
+class PointSnapshot:
+    """ Unallocated point totals per use year, read in a single pass over each point table """
+
+    def __init__(self):
+        actual_model = point_model(ActualPoint)
+        personal_model = point_model(PersonalPoint)
+
+        actual_rows = db.session.query(actual_model.use_year, actual_model.banked_date, point_total(actual_model)).\
+            filter(actual_model.trip_id.is_(None)).\
+            group_by(actual_model.use_year, actual_model.banked_date).\
+            order_by(actual_model.use_year).\
+            all()
+        self.actual_use_years = _dates([use_year for use_year, banked_date, point_count in actual_rows])
+        self.actual_totals = _running_totals([point_count for use_year, banked_date, point_count in actual_rows])
+        banked_rows = [row for row in actual_rows if row[1] is not None]
+        self.banked_use_years = _dates([use_year for use_year, banked_date, point_count in banked_rows])
+        self.banked_dates = _dates([banked_date for use_year, banked_date, point_count in banked_rows])
+        self.banked_counts = np.array([point_count for use_year, banked_date, point_count in banked_rows],
+                                      dtype=np.int64)
+
+        personal_rows = db.session.query(personal_model.owner_id, personal_model.use_year,
+                                         point_total(personal_model)).\
+            filter(personal_model.trip_id.is_(None)).\
+            group_by(personal_model.owner_id, personal_model.use_year).\
+            order_by(personal_model.owner_id, personal_model.use_year).\
+            all()
+        self.personal = {}
+        for owner_id in set(row[0] for row in personal_rows):
+            owner_rows = [row for row in personal_rows if row[0] == owner_id]
+            self.personal[owner_id] = (_dates([use_year for row_owner_id, use_year, point_count in owner_rows]),
+                                       _running_totals([point_count for row_owner_id, use_year, point_count
+                                                        in owner_rows]))
+
+    def _banked_totals(self, after, before, booked_before):
+        """ Banked actual points with after < use_year < before and banked before booked_before,
+            for every candidate """
+        if not len(self.banked_counts):
+            return np.zeros(len(after), dtype=np.int64)
+        matches = (self.banked_use_years > after[:, None]) & \
+                  (self.banked_use_years < before[:, None]) & \
+                  (self.banked_dates < booked_before[:, None])
+        return matches.astype(np.int64) @ self.banked_counts
+
+    def buckets(self, owner_ids, check_in_dates, booked_dates):
+        """ Unallocated banked, current and borrow personal and actual points usable by each candidate.
+            The arguments are equal length lists, one entry per candidate """
+        check_in = _dates(check_in_dates)
+        booked = _dates(booked_dates)
+        previous_two = _dates([check_in_date + relativedelta(years=-2) for check_in_date in check_in_dates])
+        previous = _dates([check_in_date + relativedelta(years=-1) for check_in_date in check_in_dates])
+        following = _dates([check_in_date + relativedelta(years=+1) for check_in_date in check_in_dates])
+
+        personal_buckets = [np.zeros(len(owner_ids), dtype=np.int64) for _ in range(3)]
+        owner_ids = np.array(owner_ids)
+        for owner_id, (use_years, totals) in self.personal.items():
+            candidates = owner_ids == owner_id
+            if not candidates.any():
+                continue
+            earliest = np.full(candidates.sum(), np.datetime64('0001-01-01', 'us'))
+            personal_buckets[0][candidates] = _window_totals(use_years, totals, earliest, previous[candidates])
+            personal_buckets[1][candidates] = _window_totals(use_years, totals, previous[candidates],
+                                                             check_in[candidates])
+            personal_buckets[2][candidates] = _window_totals(use_years, totals, check_in[candidates],
+                                                             following[candidates])
+
+        # points banked on the booked date itself fall in neither the banked nor the current bucket
+        actual_buckets = [
+            self._banked_totals(previous_two, previous, booked),
+            _window_totals(self.actual_use_years, self.actual_totals, previous, check_in) -
+            self._banked_totals(previous, check_in, booked + np.timedelta64(1, 'us')),
+            _window_totals(self.actual_use_years, self.actual_totals, check_in, following),
+        ]
+        return personal_buckets, actual_buckets
+
+    def simulate(self, owner_ids, check_in_dates, booked_dates, points_needed):
+        """ Banked, current and borrow points every candidate would be allocated from each pool,
+            with the shortage of each pool """
+        personal_buckets, actual_buckets = self.buckets(owner_ids, check_in_dates, booked_dates)
+        points_needed = np.array(points_needed, dtype=np.int64)
+        personal_allocated, personal_shortage = _allocate(points_needed, personal_buckets)
+        actual_allocated, actual_shortage = _allocate(points_needed, actual_buckets)
+        return personal_allocated, personal_shortage, actual_allocated, actual_shortage
@@ -0,0 +1,124 @@
+"""
+In process cache of the reference data: resorts, room types and bookable rooms.
+
+These tables change a few times a year, so every worker holds all three in memory, indexed by id and
+by name, and serves the reference list endpoints and the bookable room lookups of trip booking from
+it.  The cache is loaded when the worker starts, dropped by this worker's resort, room type and
+bookable room writes and checked against the table change counters every REFERENCE_DATA_CHECK_SECONDS
+to pick up writes committed by other workers.  A request ETagged by conditional_get (dvc_decorators.py)
+reloads it at once when its counters are newer than the snapshot, so a new ETag never goes out with an
+old body.
+
+Cached objects are detached from any session and shared between requests, so they are read only: dump
+them as they are, and attach() one before a new row refers to it.
+"""
+import threading
+import time
+
+from flask import current_app, g, has_request_context
+from sqlalchemy.orm import Session, joinedload
+
+from models import db, Resort, RoomType, BookableRoom, table_versions
+
+REFERENCE_TABLES = ('resort', 'room_type', 'bookable_room')
+
+
+class ReferenceSnapshot:
+    def __init__(self, resorts, room_types, bookable_rooms, versions):
+        self.resorts = resorts  # ordered by name
+        self.room_types = room_types  # ordered by name
+        self.bookable_rooms = bookable_rooms  # ordered by id
+        self.versions = versions  # table name -> counter when loaded, None when unreadable
+        self._resorts_by_name = dict((resort.name, resort) for resort in resorts)
+        self._room_types_by_name = dict((room_type.name, room_type) for room_type in room_types)
+        self._bookable_rooms_by_names = {}
+        for bookable_room in bookable_rooms:
+            self._bookable_rooms_by_names.setdefault((bookable_room.resort.name, bookable_room.room_type.name),
+                                                     bookable_room)
+
+    def resort(self, name):
+        return self._resorts_by_name.get(name)
+
+    def room_type(self, name):
+        return self._room_types_by_name.get(name)
+
+    def bookable_room(self, resort_name, room_type_name):
+        """ The bookable room of a resort and room type, the lowest id when there are several """
+        return self._bookable_rooms_by_names.get((resort_name, room_type_name))
+
+
+class ReferenceData:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.snapshot = None
+        self.checked_at = 0
+        self._generation = 0
+
+    def load(self):
+        with self._lock:
+            generation = self._generation
+        # counters first: a write landing in between makes them older than the rows, never newer
+        versions = table_versions(REFERENCE_TABLES)
+        if versions is not None:
+            versions = dict(zip(REFERENCE_TABLES, versions))
+        session = Session(bind=db.engine)
+        try:
+            resorts = session.query(Resort).order_by(Resort.name).all()
+            room_types = session.query(RoomType).order_by(RoomType.name).all()
+            bookable_rooms = session.query(BookableRoom).options(joinedload(BookableRoom.resort),
+                                                                 joinedload(BookableRoom.room_type)).\
+                order_by(BookableRoom.id).all()
+        finally:
+            session.close()
+        snapshot = ReferenceSnapshot(resorts, room_types, bookable_rooms, versions)
+        with self._lock:
+            # not when a write invalidated the cache while the rows were read, they may be the old ones
+            if generation == self._generation:
+                self.snapshot = snapshot
+                self.checked_at = time.time()
+        return snapshot
+
+    @staticmethod
+    def _older_than_etag(snapshot):
+        """ True when the counters the request's ETag was built from are newer than the snapshot """
+        etag_versions = g.get('table_versions') if has_request_context() else None
+        if not etag_versions:
+            return False
+        if snapshot.versions is None:
+            return True
+        return any(version > snapshot.versions[table_name] for table_name, version in etag_versions.items()
+                   if table_name in snapshot.versions)
+
+    def get(self):
+        """ The current snapshot, loaded first when missing, reloaded when older than the request's ETag
+            and checked against the counters when due """
+        with self._lock:
+            snapshot = self.snapshot
+            checked_at = self.checked_at
+        if snapshot is None or self._older_than_etag(snapshot):
+            return self.load()
+        if time.time() - checked_at > current_app.config.get('REFERENCE_DATA_CHECK_SECONDS', 60):
+            with self._lock:
+                self.checked_at = time.time()
+            versions = table_versions(REFERENCE_TABLES)
+            # without readable counters the snapshot is simply reloaded every check
+            if versions is None or dict(zip(REFERENCE_TABLES, versions)) != snapshot.versions:
+                current_app.logger.info('REFERENCE DATA - reloaded, changed by another worker')
+                return self.load()
+        return snapshot
+
+    def invalidate(self):
+        """ Drop the snapshot after a write to a reference table, the next get() loads a new one """
+        with self._lock:
+            self._generation += 1
+            self.snapshot = None
+
+
+def attach(cached):
+    """ The request session's copy of a cached object, merged without a query, or None """
+    if cached is None:
+        return None
+    return db.session.merge(cached, load=False)
+
+
+reference_data = ReferenceData()
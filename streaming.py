@@ -0,0 +1,41 @@
+"""
+Streaming JSON responses for the list endpoints.
+
+With ?stream=true a list endpoint returns its whole collection as a JSON array that is written while
+the rows are read, instead of loading, dumping and encoding the full list first.  Rows come from a
+server side cursor in batches of STREAM_BATCH_SIZE and each batch is dumped and sent before the next
+is fetched, so worker memory stays flat however large the table is.
+
+yield_per() cannot be combined with joined eager loading of collections, so the streamed query should
+lazyload('*') and the endpoint should load the few related objects the schema needs (owners, bookable
+rooms) up front and pass them as keep_loaded; many-to-one lazy loads are then answered from the
+session's identity map without a query.
+"""
+import json
+
+from flask import Response, request, stream_with_context
+
+STREAM_BATCH_SIZE = 1000
+
+
+def stream_requested():
+    return request.args.get('stream', '').lower() in ('1', 'true', 'yes')
+
+
+def stream_json_list(query, schema, keep_loaded=None, batch_size=STREAM_BATCH_SIZE):
+    """ A response streaming every row of query dumped with schema as one JSON array """
+    def generate(preloaded):
+        opening = '['
+        batch = []
+        for row in query.yield_per(batch_size).execution_options(stream_results=True):
+            batch.append(json.dumps(schema.dump(row)))
+            if len(batch) == batch_size:
+                yield opening + ','.join(batch)
+                opening = ','
+                batch = []
+        if batch:
+            yield opening + ','.join(batch)
+            opening = ','
+        yield ']\n' if opening == ',' else '[]\n'
+
+    return Response(stream_with_context(generate(keep_loaded)), mimetype='application/json')
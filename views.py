@@ -7,13 +7,15 @@ from views_resorts import ResortResource, ResortListResource, RoomTypeResource,
     BookableRoomResource, BookableRoomListResource
 from views_points import ActualPointResource, ActualPointListResource, ActualPointCountResource,\
     PersonalPointResource, PersonalPointListResource, PersonalPointCountResource, PointCount,\
-    BankPointCountResource, BankPointResource
-from views_trips import TripResource, TripListResource
+    PointCountListResource, AvailabilityCalendarResource, BankPointCountResource, BankPointResource
+from views_trips import TripResource, TripListResource, TripBatchResource, TripSimulationResource
 from views_events import EventLogResource, EventLogListResource
+from instrumentation import timed_output_json
 
 
 api_bp = Blueprint('api', __name__)
 api = Api(api_bp)
+api.representation('application/json')(timed_output_json)
 
 api.add_resource(Token, '/token/')
 api.add_resource(OwnerResource, '/owners/<int:id>')
@@ -34,9 +36,13 @@ api.add_resource(PersonalPointResource, '/personal_points/<int:id>')
 api.add_resource(PersonalPointListResource, '/personal_points/')
 api.add_resource(PersonalPointCountResource, '/personal_points_count/<owner_email>')
 api.add_resource(PointCount, '/points_count/<owner_email>')
+api.add_resource(PointCountListResource, '/points_count/')
+api.add_resource(AvailabilityCalendarResource, '/availability_calendar/')
 api.add_resource(BankPointCountResource, '/bank_points/<int:epoch_bank_date>')
 api.add_resource(BankPointResource, '/bank_points/')
 api.add_resource(TripResource, '/trips/<int:trip_id>')
 api.add_resource(TripListResource, '/trips/')
+api.add_resource(TripBatchResource, '/trips/batch')
+api.add_resource(TripSimulationResource, '/trips/simulate')
 api.add_resource(EventLogListResource, '/events/')
 api.add_resource(EventLogResource, '/events/<int:id>')
@@ -1,21 +1,42 @@
 from flask import request, jsonify
 from flask_restful import Resource
 from sqlalchemy.exc import SQLAlchemyError
-from models import db, Owner, OwnerSchema, OwnerEmail, OwnerEmailSchema, PersonalPoint, log_event
+from sqlalchemy.orm import lazyload, raiseload, selectinload
+from models import db, Owner, OwnerSchema, OwnerEmail, OwnerEmailSchema, log_event
+from views_points import get_personal_point_count
+from pagination import pagination_requested, keyset_page
+from streaming import stream_requested, stream_json_list
+from fieldsets import fieldset
+from dvc_decorators import conditional_get
+from fast_serializers import fast_serializer
+from identity_cache import identity_cache
 import status
 import datetime
-from dateutil.relativedelta import *
 from flask_jwt_extended import jwt_required, get_jwt_identity
 
 owner_schema = OwnerSchema()
 owner_email_schema = OwnerEmailSchema()
+# compiled at import rather than by the first request, owner_serializer being the full schema of ?fields=
+owner_serializer = fast_serializer(owner_schema)
+owner_email_serializer = fast_serializer(owner_email_schema)
+
+# loader options for what each resource dumps, nothing else is loaded
+OWNER_LOADER_OPTIONS = (selectinload(Owner.email).raiseload('*'),
+                        raiseload('*'))
+OWNER_EMAIL_LOADER_OPTIONS = (raiseload('*'),)
 
 
 class OwnerResource(Resource):
     @jwt_required
+    @conditional_get('owner', 'owner_email')
     def get(self, owner_id):
-        owner = Owner.query.get_or_404(owner_id)
-        result = owner_schema.dump(owner)
+        try:
+            schema, options = fieldset(Owner, OwnerSchema, OWNER_LOADER_OPTIONS)
+        except ValueError as e:
+            resp = {'message': str(e)}
+            return resp, status.HTTP_400_BAD_REQUEST
+        owner = Owner.query.options(*options).get_or_404(owner_id)
+        result = schema.dump(owner)
         return result
 
     @jwt_required
@@ -32,6 +53,7 @@ class OwnerResource(Resource):
             if 'name' in update_dict:
                 owner.name = update_dict['name']
             owner.update()
+            identity_cache.invalidate()
             log_event(get_jwt_identity(), 'UPDATE - ' + owner.__repr__())
             return self.get(owner_id)
         except SQLAlchemyError as e:
@@ -45,6 +67,7 @@ class OwnerResource(Resource):
         owner = Owner.query.get_or_404(owner_id)
         try:
             owner.delete(owner)
+            identity_cache.invalidate()
             log_event(get_jwt_identity(), 'DELETE - ' + owner.__repr__())
             return '', status.HTTP_204_NO_CONTENT
         except SQLAlchemyError as e:
@@ -58,9 +81,15 @@ class OwnerResource(Resource):
 
 class OwnerListResource(Resource):
     @jwt_required
+    @conditional_get('owner', 'owner_email')
     def get(self):
-        owners = Owner.query.order_by(Owner.id).all()
-        result = owner_schema.dump(owners, many=True)
+        try:
+            schema, options = fieldset(Owner, OwnerSchema, OWNER_LOADER_OPTIONS)
+        except ValueError as e:
+            resp = {'message': str(e)}
+            return resp, status.HTTP_400_BAD_REQUEST
+        owners = Owner.query.options(*options).order_by(Owner.id).all()
+        result = fast_serializer(schema).dump(owners, many=True)
         return result
 
     @jwt_required
@@ -89,7 +118,7 @@ class OwnerListResource(Resource):
 class OwnerEmailResource(Resource):
     @jwt_required
     def get(self, owner_id):
-        owner_email = OwnerEmail.query.get_or_404(owner_id)
+        owner_email = OwnerEmail.query.options(*OWNER_EMAIL_LOADER_OPTIONS).get_or_404(owner_id)
         result = owner_email_schema.dump(owner_email)
         return result
 
@@ -113,6 +142,7 @@ class OwnerEmailResource(Resource):
         try:
             log_event(get_jwt_identity(), 'UPDATE - ' + owner_email.__repr__())
             owner_email.update()
+            identity_cache.invalidate()
             return self.get(owner_id)
         except SQLAlchemyError as e:
             db.session.rollback()
@@ -125,6 +155,7 @@ class OwnerEmailResource(Resource):
         owner_email = OwnerEmail.query.get_or_404(owner_id)
         try:
             owner_email.delete(owner_email)
+            identity_cache.invalidate()
             log_event(get_jwt_identity(), 'DELETE - ' + owner_email.__repr__())
             return '', status.HTTP_204_NO_CONTENT
         except SQLAlchemyError as e:
@@ -137,8 +168,14 @@ class OwnerEmailResource(Resource):
 class OwnerEmailListResource(Resource):
     @jwt_required
     def get(self):
-        owner_emails = OwnerEmail.query.all()
-        result = owner_email_schema.dump(owner_emails, many=True)
+        if pagination_requested():
+            return keyset_page(OwnerEmail.query.options(*OWNER_EMAIL_LOADER_OPTIONS), OwnerEmail.id,
+                               owner_email_serializer)
+        if stream_requested():
+            return stream_json_list(OwnerEmail.query.options(lazyload('*')).order_by(OwnerEmail.id),
+                                    owner_email_serializer)
+        owner_emails = OwnerEmail.query.options(*OWNER_EMAIL_LOADER_OPTIONS).all()
+        result = owner_email_serializer.dump(owner_emails, many=True)
         return result
 
     @jwt_required
@@ -163,6 +200,7 @@ class OwnerEmailListResource(Resource):
             if 'access_level' in request_dict:
                 owner_email.access_level = request_dict['access_level']
             owner_email.add(owner_email)
+            identity_cache.invalidate()
             log_event(get_jwt_identity(), 'ADD - ' + owner_email.__repr__())
             query = OwnerEmail.query.get(owner_email.id)
             result = owner_email_schema.dump(query)
@@ -178,38 +216,14 @@ class OwnerDetailedResource(Resource):
 
     @jwt_required
     def get(self, owner_id):
-        current_owner = Owner.query.get_or_404(owner_id)
+        current_owner = Owner.query.options(*OWNER_LOADER_OPTIONS).get_or_404(owner_id)
         # current_owner = Owner.query.join(OwnerEmail).filter(OwnerEmail.owner_email == email).first()
 
         reference_date = datetime.datetime.now()
-
-        banked_count = len(PersonalPoint.query.
-                           join(Owner).
-                           filter(Owner.id == current_owner.id).
-                           filter(PersonalPoint.use_year < (reference_date + relativedelta(years=-1))).
-                           filter(PersonalPoint.trip_id.is_(None)).
-                           all())
-
-        current_count = len(PersonalPoint.query.
-                            join(Owner).
-                            filter(Owner.id == current_owner.id).
-                            filter(PersonalPoint.use_year < reference_date,
-                                   PersonalPoint.use_year > (reference_date + relativedelta(years=-1))).
-                            filter(PersonalPoint.trip_id.is_(None)).
-                            all())
-        borrow_count = len(PersonalPoint.query.
-                           join(Owner).
-                           filter(Owner.id == current_owner.id).
-                           filter(PersonalPoint.use_year < (reference_date + relativedelta(years=+1)),
-                                  PersonalPoint.use_year > reference_date).
-                           filter(PersonalPoint.trip_id.is_(None)).
-                           all())
-        # return {'banked': banked_count,
-        #         'current': current_count,
-        #         'borrow': borrow_count}
+        point_count = get_personal_point_count(current_owner.id, reference_date)
 
         current_owner_data = owner_schema.dump(current_owner)
-        current_owner_data.update({'bankedPoints': banked_count,
-                                   'currentPoints': current_count,
-                                   'borrowPoints': borrow_count})
+        current_owner_data.update({'bankedPoints': point_count['banked'],
+                                   'currentPoints': point_count['current'],
+                                   'borrowPoints': point_count['borrow']})
         return current_owner_data
@@ -1,20 +1,42 @@
 from flask_restful import Resource
 from flask import jsonify, request
 from models import db, ActualPoint, ActualPointScheme, PersonalPoint, PersonalPointSchema,\
-    Owner, OwnerEmail, log_event
+    Owner, log_event
 from flask_jwt_extended import jwt_required, get_jwt_identity
+from sqlalchemy import and_
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import joinedload, lazyload, raiseload
+from point_ranges import point_model, point_rows, point_count, point_total, claim_points
+from availability import availability_index, FREE, BANKED
+from availability_calendar import availability_calendar
+from pagination import pagination_requested, keyset_page
+from streaming import stream_requested, stream_json_list
+from fast_serializers import fast_serializer
+from columnar import columnar_requested, columnar_page
+from identity_cache import identity_cache
 from dateutil.relativedelta import *
 import datetime
 import status
 
 actual_point_schema = ActualPointScheme()
 personal_point_schema = PersonalPointSchema()
+actual_point_serializer = fast_serializer(actual_point_schema)
+personal_point_serializer = fast_serializer(personal_point_schema)
+
+# loader options for what each resource dumps, nothing else is loaded.  Relationships are named rather
+# than bound to the model, so the options also apply to point_rows() under range storage
+ACTUAL_POINT_LOADER_OPTIONS = (raiseload('*'),)
+PERSONAL_POINT_LOADER_OPTIONS = (joinedload('owner').raiseload('*'),
+                                 raiseload('*'))
 
 
 class ActualPointResource(Resource):
     @jwt_required
     def get(self, ap_id):
-        actual_point = ActualPoint.query.get_or_404(ap_id)
+        points = point_rows(ActualPoint)
+        # by id, the primary key is the use year and point number
+        actual_point = db.session.query(points).options(*ACTUAL_POINT_LOADER_OPTIONS).\
+            filter(points.id == ap_id).first_or_404()
         result = actual_point_schema.dump(actual_point)
         return result
 
@@ -22,36 +44,53 @@ class ActualPointResource(Resource):
 class ActualPointListResource(Resource):
     @jwt_required
     def get(self):
-        actual_point = ActualPoint.query.all()
-        result = actual_point_schema.dump(actual_point, many=True)
+        points = point_rows(ActualPoint)
+        if columnar_requested():
+            return columnar_page([points.id, points.use_year, points.point_number,
+                                  points.trip_id, points.banked_date],
+                                 points.id, 'api.actualpointresource')
+        if pagination_requested():
+            return keyset_page(db.session.query(points).options(*ACTUAL_POINT_LOADER_OPTIONS), points.id,
+                               actual_point_serializer)
+        if stream_requested():
+            return stream_json_list(db.session.query(points).order_by(points.id), actual_point_serializer)
+        actual_point = db.session.query(points).options(*ACTUAL_POINT_LOADER_OPTIONS).all()
+        result = actual_point_serializer.dump(actual_point, many=True)
         return result
 
 
 def get_actual_point_count(reference_date):
-    banked_count = len(ActualPoint.query.
-                       filter(ActualPoint.use_year < (reference_date + relativedelta(years=-1)),
-                              ActualPoint.use_year > (reference_date + relativedelta(years=-2))).
-                       filter(ActualPoint.trip_id.is_(None)).
-                       filter(ActualPoint.banked_date.isnot(None)).
-                       all())
-    current_count = len(ActualPoint.query.
-                        filter(ActualPoint.use_year < reference_date,
-                               ActualPoint.use_year > (reference_date + relativedelta(years=-1))).
-                        filter(ActualPoint.trip_id.is_(None)).
-                        filter(ActualPoint.banked_date.is_(None)).
-                        all())
-    current_banked_count = len(ActualPoint.query.
-                               filter(ActualPoint.use_year < reference_date,
-                                      ActualPoint.use_year > (reference_date + relativedelta(years=-1))).
-                               filter(ActualPoint.trip_id.is_(None)).
-                               filter(ActualPoint.banked_date.isnot(None)).
-                               all())
-    borrow_count = len(ActualPoint.query.
-                       filter(ActualPoint.use_year < (reference_date + relativedelta(years=+1)),
-                              ActualPoint.use_year > reference_date).
-                       filter(ActualPoint.trip_id.is_(None)).
-                       filter(ActualPoint.banked_date.is_(None)).
-                       all())
+    previous_use_year = reference_date + relativedelta(years=-1)
+    previous_two_use_year = reference_date + relativedelta(years=-2)
+    next_use_year = reference_date + relativedelta(years=+1)
+    if availability_index.ready():
+        return {'banked': availability_index.actual_count(previous_two_use_year, previous_use_year, BANKED),
+                'current': availability_index.actual_count(previous_use_year, reference_date, FREE),
+                'current_banked': availability_index.actual_count(previous_use_year, reference_date, BANKED),
+                'borrow': availability_index.actual_count(reference_date, next_use_year, FREE)}
+    model = point_model(ActualPoint)
+
+    banked_count, current_count, current_banked_count, borrow_count = db.session.query(
+        point_total(model,
+                    model.use_year < previous_use_year,
+                    model.use_year > previous_two_use_year,
+                    model.banked_date.isnot(None)),
+        point_total(model,
+                    model.use_year < reference_date,
+                    model.use_year > previous_use_year,
+                    model.banked_date.is_(None)),
+        point_total(model,
+                    model.use_year < reference_date,
+                    model.use_year > previous_use_year,
+                    model.banked_date.isnot(None)),
+        point_total(model,
+                    model.use_year < next_use_year,
+                    model.use_year > reference_date,
+                    model.banked_date.is_(None))).\
+        filter(model.use_year > previous_two_use_year,
+               model.use_year < next_use_year).\
+        filter(model.trip_id.is_(None)).\
+        one()
 
     return {'banked': banked_count,
             'current': current_count,
@@ -69,7 +108,10 @@ class ActualPointCountResource(Resource):
 class PersonalPointResource(Resource):
     @jwt_required
     def get(self, pp_id):
-        personal_point = PersonalPoint.query.get_or_404(pp_id)
+        points = point_rows(PersonalPoint)
+        # by id, the primary key is the use year, point number and owner
+        personal_point = db.session.query(points).options(*PERSONAL_POINT_LOADER_OPTIONS).\
+            filter(points.id == pp_id).first_or_404()
         result = personal_point_schema.dump(personal_point)
         return result
 
@@ -77,32 +119,57 @@ class PersonalPointResource(Resource):
 class PersonalPointListResource(Resource):
     @jwt_required
     def get(self):
-        personal_point = PersonalPoint.query.all()
-        result = personal_point_schema.dump(personal_point, many=True)
+        points = point_rows(PersonalPoint)
+        if columnar_requested():
+            # owner names once per owner rather than once per point
+            return columnar_page([points.id, points.use_year, points.point_number,
+                                  points.owner_id, points.trip_id],
+                                 points.id, 'api.personalpointresource',
+                                 owners=dict((str(owner_id), name) for owner_id, name in
+                                             db.session.query(Owner.id, Owner.name)))
+        if pagination_requested():
+            return keyset_page(db.session.query(points).options(*PERSONAL_POINT_LOADER_OPTIONS), points.id,
+                               personal_point_serializer)
+        if stream_requested():
+            owners = Owner.query.options(lazyload('*')).all()
+            return stream_json_list(db.session.query(points).options(lazyload('*')).order_by(points.id),
+                                    personal_point_serializer, keep_loaded=owners)
+        personal_point = db.session.query(points).options(*PERSONAL_POINT_LOADER_OPTIONS).all()
+        result = personal_point_serializer.dump(personal_point, many=True)
         return result
 
 
-def get_personal_point_count(email, reference_date):
-    banked_count = len(PersonalPoint.query.
-                       join(Owner).join(OwnerEmail).
-                       filter(OwnerEmail.owner_email == email).
-                       filter(PersonalPoint.use_year < (reference_date + relativedelta(years=-1))).
-                       filter(PersonalPoint.trip_id.is_(None)).
-                       all())
-    current_count = len(PersonalPoint.query.
-                        join(Owner).join(OwnerEmail).
-                        filter(OwnerEmail.owner_email == email).
-                        filter(PersonalPoint.use_year < reference_date,
-                               PersonalPoint.use_year > (reference_date + relativedelta(years=-1))).
-                        filter(PersonalPoint.trip_id.is_(None)).
-                        all())
-    borrow_count = len(PersonalPoint.query.
-                       join(Owner).join(OwnerEmail).
-                       filter(OwnerEmail.owner_email == email).
-                       filter(PersonalPoint.use_year < (reference_date + relativedelta(years=+1)),
-                              PersonalPoint.use_year > reference_date).
-                       filter(PersonalPoint.trip_id.is_(None)).
-                       all())
+def personal_point_buckets(model, reference_date):
+    """ Banked, current and borrow counts of unallocated personal points for a check in at reference_date """
+    previous_use_year = reference_date + relativedelta(years=-1)
+    next_use_year = reference_date + relativedelta(years=+1)
+    return (point_total(model, model.use_year < previous_use_year),
+            point_total(model, model.use_year < reference_date, model.use_year > previous_use_year),
+            point_total(model, model.use_year < next_use_year, model.use_year > reference_date))
+
+
+def get_personal_point_count(owner, reference_date):
+    """ Personal point balance of an owner, given either the owner id or one of the owner's emails """
+    if isinstance(owner, int):
+        owner_id = owner
+    else:
+        identity = identity_cache.get(owner)
+        owner_id = identity.owner_id if identity is not None else None
+    if availability_index.ready():
+        previous_use_year = reference_date + relativedelta(years=-1)
+        next_use_year = reference_date + relativedelta(years=+1)
+        return {'banked': availability_index.personal_count(owner_id, None, previous_use_year),
+                'current': availability_index.personal_count(owner_id, previous_use_year, reference_date),
+                'borrow': availability_index.personal_count(owner_id, reference_date, next_use_year)}
+    model = point_model(PersonalPoint)
+    # an unknown email has no owner id and counts no points
+    banked_count, current_count, borrow_count = db.session.query(*personal_point_buckets(model, reference_date)).\
+        select_from(model).\
+        filter(model.owner_id == owner_id).\
+        filter(model.use_year < (reference_date + relativedelta(years=+1))).\
+        filter(model.trip_id.is_(None)).\
+        one()
+
     return {'banked': banked_count,
             'current': current_count,
             'borrow': borrow_count}
@@ -126,16 +193,67 @@ class PointCount(Resource):
                 'personal_points': personal_points}
 
 
+class PointCountListResource(Resource):
+    @jwt_required
+    def get(self):
+        reference_date = datetime.datetime.now()
+        model = point_model(PersonalPoint)
+        owner_counts = db.session.query(Owner.id, Owner.name, *personal_point_buckets(model, reference_date)).\
+            outerjoin(model, and_(model.owner_id == Owner.id,
+                                  model.use_year < (reference_date + relativedelta(years=+1)),
+                                  model.trip_id.is_(None))).\
+            group_by(Owner.id, Owner.name).\
+            order_by(Owner.id).\
+            all()
+        personal_points = [{'owner_id': owner_id,
+                            'name': name,
+                            'banked': banked_count,
+                            'current': current_count,
+                            'borrow': borrow_count}
+                           for owner_id, name, banked_count, current_count, borrow_count in owner_counts]
+
+        return {'actual_points': get_actual_point_count(reference_date),
+                'personal_points': personal_points}
+
+
+def get_bankable_point_count(bank_date):
+    """ Unallocated, unbanked actual points in the use year ending at bank_date """
+    if availability_index.ready():
+        return availability_index.actual_count(bank_date + relativedelta(years=-1), bank_date, FREE)
+    model = point_model(ActualPoint)
+    bankable_count, = db.session.query(point_total(model)).\
+        filter(model.use_year < bank_date,
+               model.use_year > (bank_date + relativedelta(years=-1))).\
+        filter(model.trip_id.is_(None)).filter(model.banked_date.is_(None)).\
+        one()
+    return bankable_count
+
+
+def bank_points(bank_date, count_to_bank):
+    """ Bank up to count_to_bank points, locked in one SELECT and banked in one UPDATE, or by splitting
+        ranges under range compressed storage, and return how many were banked.  Points a concurrent
+        claim holds are waited on only when the rest cannot fill the bank (see claim_points) """
+    model = point_model(ActualPoint)
+    banked = claim_points(model, {'banked_date': bank_date}, count_to_bank,
+                          model.use_year < bank_date,
+                          model.use_year > (bank_date + relativedelta(years=-1)),
+                          model.trip_id.is_(None),
+                          model.banked_date.is_(None))
+    availability_index.record(model, banked, BANKED)
+    return point_count(model, banked)
+
+
+class AvailabilityCalendarResource(Resource):
+    @jwt_required
+    def get(self):
+        return availability_calendar.get()
+
+
 class BankPointCountResource(Resource):
     @jwt_required
     def get(self, epoch_bank_date):
         bank_date = datetime.datetime.fromtimestamp(epoch_bank_date)
-        banked_count = len(ActualPoint.query.
-                           filter(ActualPoint.use_year < bank_date,
-                                  ActualPoint.use_year > (bank_date + relativedelta(years=-1))).
-                           filter(ActualPoint.trip_id.is_(None)).filter(ActualPoint.banked_date.is_(None)).
-                           all())
-        return {'available_bank_count': banked_count,
+        return {'available_bank_count': get_bankable_point_count(bank_date),
                 'bank_date': bank_date.strftime('%Y-%m-%d')}
 
 
@@ -148,26 +266,41 @@ class BankPointResource(Resource):
             return resp, status.HTTP_400_BAD_REQUEST
         bank_date = datetime.datetime.fromtimestamp(
             request_dict['epoch_bank_date'])
-        bankable_points = ActualPoint.query.\
-            filter(ActualPoint.use_year < bank_date,
-                   ActualPoint.use_year > (bank_date + relativedelta(years=-1))).\
-            filter(ActualPoint.trip_id.is_(None)).filter(ActualPoint.banked_date.is_(None)).\
-            limit(request_dict['count_to_bank']).all()
-
-        if request_dict['count_to_bank'] > len(bankable_points):
-            resp = jsonify(
-                {"error": "requested bank is more than available bankable points"})
+        count_to_bank = request_dict['count_to_bank']
+
+        if request_dict.get('dry_run'):
+            available_bank_count = get_bankable_point_count(bank_date)
+            if count_to_bank > available_bank_count:
+                resp = jsonify(
+                    {"error": "requested bank is more than available bankable points"})
+                resp.status_code = status.HTTP_400_BAD_REQUEST
+                return resp
+            return {'dry_run': True,
+                    'banked_count': count_to_bank,
+                    'available_bank_count': available_bank_count,
+                    'bank_date': bank_date.strftime('%Y-%m-%d')}
+
+        # the UPDATE and the availability check share one transaction, so a short bank changes nothing
+        try:
+            banked_count = bank_points(bank_date, count_to_bank)
+            if count_to_bank > banked_count:
+                db.session.rollback()
+                resp = jsonify(
+                    {"error": "requested bank is more than available bankable points"})
+                resp.status_code = status.HTTP_400_BAD_REQUEST
+                return resp
+            db.session.commit()
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            resp = jsonify({"error": str(e)})
             resp.status_code = status.HTTP_400_BAD_REQUEST
             return resp
 
-        for point in bankable_points:
-            point.banked_date = bank_date
-
-        log = 'POINTS BANKED - %s points banked with a bank date of %s' % (len(bankable_points),
+        log = 'POINTS BANKED - %s points banked with a bank date of %s' % (banked_count,
                                                                            bank_date.strftime('%Y-%m-%d %H:%M:%S'))
-
-        db.session.commit()
+        availability_calendar.refresh()
         log_event(get_jwt_identity(), log)
-        resp = jsonify({})
+        resp = jsonify({'banked_count': banked_count,
+                        'bank_date': bank_date.strftime('%Y-%m-%d')})
         resp.status_code = status.HTTP_201_CREATED
         return resp
@@ -1,20 +1,35 @@
 from flask import request, jsonify
 from flask_restful import Resource
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import joinedload, raiseload
 from models import db, Resort, ResortSchema, RoomType, RoomTypeSchema, BookableRoom, BookableRoomSchema, log_event
 from flask_jwt_extended import jwt_required, get_jwt_identity
+from fieldsets import fieldset
+from dvc_decorators import conditional_get
+from fast_serializers import fast_serializer
+from reference_data import reference_data, attach
 import status
 
 
 resort_schema = ResortSchema()
 room_type_schema = RoomTypeSchema()
 bookable_room_schema = BookableRoomSchema()
+# the full schema of ?fields=, compiled at import rather than by the first request
+bookable_room_serializer = fast_serializer(bookable_room_schema)
+
+# loader options for what each resource dumps, nothing else is loaded
+RESORT_LOADER_OPTIONS = (raiseload('*'),)
+ROOM_TYPE_LOADER_OPTIONS = (raiseload('*'),)
+BOOKABLE_ROOM_LOADER_OPTIONS = (joinedload(BookableRoom.resort).raiseload('*'),
+                                joinedload(BookableRoom.room_type).raiseload('*'),
+                                raiseload('*'))
 
 
 class ResortResource(Resource):
     @jwt_required
+    @conditional_get('resort')
     def get(self, id):
-        resort = Resort.query.get_or_404(id)
+        resort = Resort.query.options(*RESORT_LOADER_OPTIONS).get_or_404(id)
         result = resort_schema.dump(resort)
         return result
 
@@ -35,6 +50,7 @@ class ResortResource(Resource):
             return validate_errors, status.HTTP_400_BAD_REQUEST
         try:
             resort.update()
+            reference_data.invalidate()
             log_event(get_jwt_identity(), "UPDATE " + resort.__repr__())
             return self.get(id)
         except SQLAlchemyError as e:
@@ -48,6 +64,7 @@ class ResortResource(Resource):
         resort = Resort.query.get_or_404(id)
         try:
             resort.delete(resort)
+            reference_data.invalidate()
             log_event(get_jwt_identity(), "DELETE - " + resort.__repr__())
             return None, status.HTTP_200_OK
         except SQLAlchemyError as e:
@@ -59,8 +76,9 @@ class ResortResource(Resource):
 
 class ResortListResource(Resource):
     @jwt_required
+    @conditional_get('resort')
     def get(self):
-        resort = Resort.query.order_by(Resort.name).all()
+        resort = reference_data.get().resorts
         result = resort_schema.dump(resort, many=True)
         return result
 
@@ -76,6 +94,7 @@ class ResortListResource(Resource):
         try:
             resort = Resort(request_dict['name'])
             resort.add(resort)
+            reference_data.invalidate()
             log_event(get_jwt_identity(), "ADD - " + resort.__repr__())
             query = Resort.query.get(resort.id)
             result = resort_schema.dump(query)
@@ -89,8 +108,9 @@ class ResortListResource(Resource):
 
 class RoomTypeResource(Resource):
     @jwt_required
+    @conditional_get('room_type')
     def get(self, id):
-        room_type = RoomType.query.get_or_404(id)
+        room_type = RoomType.query.options(*ROOM_TYPE_LOADER_OPTIONS).get_or_404(id)
         result = room_type_schema.dump(room_type)
         return result
 
@@ -113,6 +133,7 @@ class RoomTypeResource(Resource):
             return validate_errors, status.HTTP_400_BAD_REQUEST
         try:
             room_type.update()
+            reference_data.invalidate()
             log_event(get_jwt_identity(), "UPDATE - " + room_type.__repr__())
             return self.get(id)
         except SQLAlchemyError as e:
@@ -126,6 +147,7 @@ class RoomTypeResource(Resource):
         room_type = RoomType.query.get_or_404(id)
         try:
             room_type.delete(room_type)
+            reference_data.invalidate()
             log_event(get_jwt_identity(), "DELETE - " + room_type.__repr__())
             return None, status.HTTP_200_OK
         except SQLAlchemyError as e:
@@ -137,8 +159,9 @@ class RoomTypeResource(Resource):
 
 class RoomTypeListResource(Resource):
     @jwt_required
+    @conditional_get('room_type')
     def get(self):
-        room_type = RoomType.query.order_by(RoomType.name).all()
+        room_type = reference_data.get().room_types
         result = room_type_schema.dump(room_type, many=True)
         return result
 
@@ -156,6 +179,7 @@ class RoomTypeListResource(Resource):
             if 'sleeps' in request_dict:
                 room_type.sleeps = request_dict['sleeps']
             room_type.add(room_type)
+            reference_data.invalidate()
             log_event(get_jwt_identity(), "ADD - " + room_type.__repr__())
             query = RoomType.query.get(room_type.id)
             result = room_type_schema.dump(query)
@@ -169,9 +193,15 @@ class RoomTypeListResource(Resource):
 
 class BookableRoomResource(Resource):
     @jwt_required
+    @conditional_get('bookable_room', 'resort', 'room_type')
     def get(self, id):
-        bookable_room = BookableRoom.query.get_or_404(id)
-        result = bookable_room_schema.dump(bookable_room)
+        try:
+            schema, options = fieldset(BookableRoom, BookableRoomSchema, BOOKABLE_ROOM_LOADER_OPTIONS)
+        except ValueError as e:
+            resp = {'message': str(e)}
+            return resp, status.HTTP_400_BAD_REQUEST
+        bookable_room = BookableRoom.query.options(*options).get_or_404(id)
+        result = schema.dump(bookable_room)
         return result
 
     @jwt_required
@@ -183,7 +213,7 @@ class BookableRoomResource(Resource):
             return resp, status.HTTP_400_BAD_REQUEST
         if 'resort' in update_dict:
             resort_name = update_dict['resort']['name']
-            resort = Resort.query.filter_by(name=resort_name).first()
+            resort = attach(reference_data.get().resort(resort_name))
             if resort is None:
                 # Resort does not exist
                 resp = {'message': 'resort name does not exist'}
@@ -191,7 +221,7 @@ class BookableRoomResource(Resource):
             bookable_room.resort = resort
         if 'room_type' in update_dict:
             room_type_name = update_dict['room_type']['name']
-            room_type = RoomType.query.filter_by(name=room_type_name).first()
+            room_type = attach(reference_data.get().room_type(room_type_name))
             if room_type is None:
                 # Resort does not exist
                 resp = {'message': 'room type name does not exist'}
@@ -205,6 +235,7 @@ class BookableRoomResource(Resource):
             return validate_errors, status.HTTP_400_BAD_REQUEST
         try:
             bookable_room.update()
+            reference_data.invalidate()
             log_event(get_jwt_identity(), "UPDATE - " +
                       bookable_room.__repr__())
             return self.get(id)
@@ -219,6 +250,7 @@ class BookableRoomResource(Resource):
         bookable_room = BookableRoom.query.get_or_404(id)
         try:
             bookable_room.delete(bookable_room)
+            reference_data.invalidate()
             log_event(get_jwt_identity(), "DELETE - " +
                       bookable_room.__repr__())
             return None, status.HTTP_200_OK
@@ -231,9 +263,17 @@ class BookableRoomResource(Resource):
 
 class BookableRoomListResource(Resource):
     @jwt_required
+    @conditional_get('bookable_room', 'resort', 'room_type')
     def get(self):
-        bookable_room = BookableRoom.query.all()
-        result = bookable_room_schema.dump(bookable_room, many=True)
+        # only the schema: the list is dumped from the reference data, which runs no query to take options,
+        # and its rooms always have their resort and room type loaded
+        try:
+            schema, _ = fieldset(BookableRoom, BookableRoomSchema, BOOKABLE_ROOM_LOADER_OPTIONS)
+        except ValueError as e:
+            resp = {'message': str(e)}
+            return resp, status.HTTP_400_BAD_REQUEST
+        bookable_room = reference_data.get().bookable_rooms
+        result = fast_serializer(schema).dump(bookable_room, many=True)
         return result
 
     @jwt_required
@@ -247,19 +287,20 @@ class BookableRoomListResource(Resource):
             return errors, status.HTTP_400_BAD_REQUEST
         try:
             resort_name = request_dict['resort']['name']
-            resort = Resort.query.filter_by(name=resort_name).first()
+            resort = attach(reference_data.get().resort(resort_name))
             if resort is None:
                 # Resort does not exist
                 resp = {'message': 'resort name does not exist'}
                 return resp, status.HTTP_400_BAD_REQUEST
             room_type_name = request_dict['room_type']['name']
-            room_type = RoomType.query.filter_by(name=room_type_name).first()
+            room_type = attach(reference_data.get().room_type(room_type_name))
             if room_type is None:
                 # Room Type does not exist
                 resp = {'message': 'room type name does not exist'}
                 return resp, status.HTTP_400_BAD_REQUEST
             bookable_room = BookableRoom(resort, room_type)
             bookable_room.add(bookable_room)
+            reference_data.invalidate()
             log_event(get_jwt_identity(), "ADD - " + bookable_room.__repr__())
             query = BookableRoom.query.get(bookable_room.id)
             result = bookable_room_schema.dump(query)
@@ -8,7 +8,8 @@ from google.auth.transport import requests
 from google.oauth2 import id_token
 
 import status
-from models import TokenUser, OwnerEmail, Owner, log_event
+from models import TokenUser, log_event
+from identity_cache import identity_cache
 
 
 class Token(Resource):
@@ -96,14 +97,9 @@ class Token(Resource):
             return response_object, status.HTTP_401_UNAUTHORIZED
 
         # find a valid owner email
-        # owner = OwnerEmail.query.filter_by(owner_email = idinfo['email']).first()
-        owner = Owner.query.join(OwnerEmail).filter(OwnerEmail.owner_email == idinfo['email']).first()
+        owner = identity_cache.get(idinfo['email'])
         if owner:
-            access_level = 0
-            for owner_emails in owner.email:
-                if owner_emails.owner_email == idinfo['email']:
-                    access_level = owner_emails.access_level
-                    # print(owner_emails.owner_email + " has access level " + str(owner_emails.access_level))
+            access_level = owner.access_level
             user_claims = {
                 "access_level": access_level
             }
@@ -123,7 +119,7 @@ class Token(Resource):
                 'picture': idinfo['picture'],
                 'access_level': access_level
             }
-            log_event(idinfo['email'], 'User authenticated - ' + owner.__repr__())
+            log_event(idinfo['email'], 'User authenticated - Owner(%s) - ID(%s)' % (owner.name, owner.owner_id))
             return response_object, status.HTTP_201_CREATED
         else:
             response_object = {
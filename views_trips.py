@@ -8,15 +8,156 @@ from dateutil.relativedelta import *
 from datetime import datetime
 from models import db, PersonalPoint, ActualPoint, log_event
 from sqlalchemy import or_
+from sqlalchemy.orm import joinedload, lazyload, raiseload
+from point_ranges import point_model, point_count, is_range_model, claim_points, release_range_points
+from availability import availability_index, UNAVAILABLE
+from availability_calendar import availability_calendar
+from point_simulation import PointSnapshot
+from pagination import pagination_requested, keyset_page
+from streaming import stream_requested, stream_json_list
+from fieldsets import fieldset
+from dvc_decorators import conditional_get
+from fast_serializers import fast_serializer
+from reference_data import reference_data, attach
 
 trip_schema = TripSchema()
+# the full schema, compiled at import rather than by the first request
+trip_serializer = fast_serializer(trip_schema)
+
+# loader options for what a trip dumps: its owner with the owner's emails and its bookable room with the
+# room's resort and room type, nothing else is loaded
+TRIP_LOADER_OPTIONS = (joinedload(Trip.owner).raiseload('*'),
+                       joinedload(Trip.owner).selectinload(Owner.email).raiseload('*'),
+                       joinedload(Trip.bookable_room).raiseload('*'),
+                       joinedload(Trip.bookable_room).joinedload(BookableRoom.resort).raiseload('*'),
+                       joinedload(Trip.bookable_room).joinedload(BookableRoom.room_type).raiseload('*'),
+                       raiseload('*'))
+
+
+def allocate_points(model, trip_id, points_needed, *criteria):
+    """ Assign up to points_needed unallocated points matching criteria to a trip, locking them in one
+        SELECT and assigning them in one UPDATE, or by splitting ranges under range compressed storage,
+        lowest use year and point number first, and return how many were assigned.
+        Points already locked by a concurrent booking are skipped, so parallel bookings never select,
+        and then overwrite, the same point, and only waited on when the rest cannot fill the trip
+        (see claim_points) """
+    if points_needed <= 0:
+        return 0
+    allocated = claim_points(model, {'trip_id': trip_id}, points_needed, model.trip_id.is_(None), *criteria)
+    availability_index.record(model, allocated, UNAVAILABLE)
+    return point_count(model, allocated)
+
+
+def allocate_trip_points(trip):
+    """ Allocate the personal and then the actual points of a flushed trip, banked -> current -> borrow.
+        Returns the [banked, current, borrow] counts of each pool and a shortage message, if any """
+    current_use_year = trip.check_in_date
+    previous_use_year = current_use_year+relativedelta(years=-1)
+    next_use_year = current_use_year+relativedelta(years=1)
+    previous_two_use_year = current_use_year+relativedelta(years=-2)
+    booked_date = trip.booked_date
+    personal_model = point_model(PersonalPoint)
+    actual_model = point_model(ActualPoint)
+
+    personal_buckets = [
+        # banked personal points
+        (personal_model.use_year < previous_use_year,),
+        # current personal points
+        (personal_model.use_year < current_use_year, personal_model.use_year > previous_use_year),
+        # borrow personal points
+        (personal_model.use_year < next_use_year, personal_model.use_year > current_use_year),
+    ]
+    personal_points_needed = trip.points_needed
+    personal_allocated = []
+    for criteria in personal_buckets:
+        allocated = allocate_points(personal_model, trip.id, personal_points_needed,
+                                    personal_model.owner_id == trip.owner_id, *criteria)
+        personal_allocated.append(allocated)
+        personal_points_needed -= allocated
+    if personal_points_needed > 0:
+        return personal_allocated, [], 'personal points shortage of %s points' % personal_points_needed
+
+    actual_buckets = [
+        # banked actual points
+        (actual_model.use_year < previous_use_year, actual_model.use_year > previous_two_use_year,
+         actual_model.banked_date < booked_date),
+        # current actual points, including those banked after the booking
+        (actual_model.use_year < current_use_year, actual_model.use_year > previous_use_year,
+         or_(actual_model.banked_date.is_(None), actual_model.banked_date > booked_date)),
+        # borrow actual points
+        (actual_model.use_year < next_use_year, actual_model.use_year > current_use_year),
+    ]
+    actual_points_needed = trip.points_needed
+    actual_allocated = []
+    for criteria in actual_buckets:
+        allocated = allocate_points(actual_model, trip.id, actual_points_needed, *criteria)
+        actual_allocated.append(allocated)
+        actual_points_needed -= allocated
+    if actual_points_needed > 0:
+        return personal_allocated, actual_allocated, 'actual points shortage of %s points' % actual_points_needed
+
+    return personal_allocated, actual_allocated, None
+
+
+def release_points(model, trip_id):
+    """ Return every point of a trip to the unallocated pool in one UPDATE, or by merging ranges
+        under range compressed storage, and return how many were released """
+    if is_range_model(model):
+        released = release_range_points(model, trip_id)
+    else:
+        released = db.session.query(*model.__table__.c)\
+            .filter(model.trip_id == trip_id)\
+            .all()
+        db.session.query(model)\
+            .filter(model.trip_id == trip_id)\
+            .update({model.trip_id: None}, synchronize_session=False)
+    availability_index.record(model, released)
+    return point_count(model, released)
+
+
+def trip_fields_from_request(request_dict):
+    """ Parse the trip columns of TripSchema shaped data, or return why they are invalid """
+    trip_fields = {
+        'check_in_date': datetime.strptime(request_dict['check_in_date'].split('T')[0], '%Y-%m-%d'),
+        'check_out_date': datetime.strptime(request_dict['check_out_date'].split('T')[0], '%Y-%m-%d'),
+        'booked_date': datetime.strptime(request_dict['booked_date'].split('T')[0], '%Y-%m-%d'),
+        'notes': request_dict.get('notes'),
+        'points_needed': request_dict['points_needed']
+    }
+    if trip_fields['check_in_date'] >= trip_fields['check_out_date']:
+        return None, 'check out must be after check in date'
+    if trip_fields['points_needed'] < 0:
+        return None, 'points needed must be at least 1'
+    return trip_fields, None
+
+
+def new_trip_with_fields(trip_owner, trip_bookable_room, trip_fields):
+    new_trip = Trip(trip_owner, trip_bookable_room)
+    for column, value in trip_fields.items():
+        setattr(new_trip, column, value)
+    return new_trip
+
+
+def log_trip_allocation(trip, personal_allocated, actual_allocated):
+    """ Add the CREATE and allocation events of a booked trip, committed with the trip """
+    log_event(get_jwt_identity(), 'CREATE - ' + trip.__repr__(), commit=False)
+    log_event(get_jwt_identity(),
+              'Personal Points Allocated: [%s,%s,%s]' % tuple(personal_allocated), commit=False)
+    log_event(get_jwt_identity(),
+              'Actual Points Allocated: [%s,%s,%s]' % tuple(actual_allocated), commit=False)
 
 
 class TripResource(Resource):
     @jwt_required
+    @conditional_get('trip', 'owner', 'owner_email', 'bookable_room', 'resort', 'room_type')
     def get(self, trip_id):
-        trip = Trip.query.get_or_404(trip_id)
-        result = trip_schema.dump(trip)
+        try:
+            schema, options = fieldset(Trip, TripSchema, TRIP_LOADER_OPTIONS)
+        except ValueError as e:
+            resp = {'message': str(e)}
+            return resp, status.HTTP_400_BAD_REQUEST
+        trip = Trip.query.options(*options).get_or_404(trip_id)
+        result = schema.dump(trip)
         return result
 
     @jwt_required
@@ -57,20 +198,23 @@ class TripResource(Resource):
 
     @jwt_required
     def delete(self, trip_id: int):
-        trip: Trip = db.session.query(Trip).get_or_404(trip_id)
-        personal_points = db.session.query(
-            PersonalPoint).filter_by(trip_id=trip_id).all()
-        for point in personal_points:
-            point.trip_id = None
-        actual_points = db.session.query(
-            ActualPoint).filter_by(trip_id=trip_id).all()
-        for point in actual_points:
-            point.trip_id = None
+        # only what the DELETE log line needs, not the trip's full eager graph
+        trip: Trip = db.session.query(Trip).options(
+            joinedload(Trip.owner).lazyload('*'),
+            joinedload(Trip.bookable_room).lazyload('*'),
+            joinedload(Trip.bookable_room).joinedload(BookableRoom.resort).lazyload('*'),
+            joinedload(Trip.bookable_room).joinedload(BookableRoom.room_type).lazyload('*')).get_or_404(trip_id)
         try:
+            personal_released = release_points(point_model(PersonalPoint), trip_id)
+            actual_released = release_points(point_model(ActualPoint), trip_id)
+            trip_log = 'DELETE - ' + trip.__repr__()
             db.session.delete(trip)
             db.session.commit()
-            log_event(get_jwt_identity(), 'DELETE - ' + trip.__repr__())
-            return None, status.HTTP_200_OK
+            availability_calendar.refresh()
+            log_event(get_jwt_identity(), trip_log)
+            return {'trip_id': trip_id,
+                    'personal_points_released': personal_released,
+                    'actual_points_released': actual_released}, status.HTTP_200_OK
         except SQLAlchemyError as e:
             db.session.rollback()
             resp = jsonify({"error": str(e)})
@@ -80,9 +224,22 @@ class TripResource(Resource):
 
 class TripListResource(Resource):
     @jwt_required
+    @conditional_get('trip', 'owner', 'owner_email', 'bookable_room', 'resort', 'room_type')
     def get(self):
-        trip = Trip.query.all()
-        result = trip_schema.dump(trip, many=True)
+        try:
+            schema, options = fieldset(Trip, TripSchema, TRIP_LOADER_OPTIONS)
+        except ValueError as e:
+            resp = {'message': str(e)}
+            return resp, status.HTTP_400_BAD_REQUEST
+        if pagination_requested():
+            return keyset_page(Trip.query.options(*options), Trip.id, fast_serializer(schema))
+        if stream_requested():
+            owners = Owner.query.options(lazyload('*'), joinedload(Owner.email).lazyload('*')).all()
+            bookable_rooms = [attach(bookable_room) for bookable_room in reference_data.get().bookable_rooms]
+            return stream_json_list(Trip.query.options(lazyload('*')).order_by(Trip.id), fast_serializer(schema),
+                                    keep_loaded=(owners, bookable_rooms))
+        trip = Trip.query.options(*options).all()
+        result = fast_serializer(schema).dump(trip, many=True)
         return result
 
     @jwt_required
@@ -103,166 +260,181 @@ class TripListResource(Resource):
                 resp = {'message': 'owner does not exist'}
                 return resp, status.HTTP_400_BAD_REQUEST
             # new_trip.owner_id = trip_owner.id
-            trip_bookable_room = BookableRoom.query. \
-                filter(BookableRoom.resort.has(name=request_dict['bookable_room']['resort']['name'])). \
-                filter(BookableRoom.room_type.has(
-                    name=request_dict['bookable_room']['room_type']['name'])).first()
+            trip_bookable_room = attach(reference_data.get().bookable_room(
+                request_dict['bookable_room']['resort']['name'], request_dict['bookable_room']['room_type']['name']))
             if trip_bookable_room is None:
                 # Resort does not exist
                 resp = {'message': 'bookable room does not exist'}
                 return resp, status.HTTP_400_BAD_REQUEST
-            new_trip = Trip(trip_owner, trip_bookable_room)
-            new_trip.check_in_date = datetime.strptime(
-                request_dict['check_in_date'].split('T')[0], '%Y-%m-%d')
-            new_trip.check_out_date = datetime.strptime(
-                request_dict['check_out_date'].split('T')[0], '%Y-%m-%d')
-            if new_trip.check_in_date >= new_trip.check_out_date:
-                resp = {'message': 'check out must be after check in date'}
-                return resp, status.HTTP_400_BAD_REQUEST
-            new_trip.booked_date = datetime.strptime(
-                request_dict['booked_date'].split('T')[0], '%Y-%m-%d')
-            new_trip.notes = request_dict['notes']
-            new_trip.points_needed = request_dict['points_needed']
-            if new_trip.points_needed < 0:
-                resp = {'message': 'points needed must be at least 1'}
+            trip_fields, message = trip_fields_from_request(request_dict)
+            if message:
+                resp = {'message': message}
                 return resp, status.HTTP_400_BAD_REQUEST
-        db.session.flush()
-
-        # New trip is valid now try to allocate points
-
-        current_use_year = new_trip.check_in_date
-        previous_use_year = current_use_year+relativedelta(years=-1)
-        next_use_year = current_use_year+relativedelta(years=1)
-        previous_two_use_year = current_use_year+relativedelta(years=-2)
-        booked_date = new_trip.booked_date
-
-        personal_points_needed = new_trip.points_needed
-        trip_owner_id = new_trip.owner_id
-        # Find banked personal points
-        personal_points_banked = db.session.query(PersonalPoint)\
-            .filter(PersonalPoint.owner_id == trip_owner_id,
-                    PersonalPoint.trip_id.is_(None),
-                    PersonalPoint.use_year < previous_use_year)\
-            .order_by("use_year").order_by("point_number")\
-            .limit(personal_points_needed).all()
-
-        for point in personal_points_banked:
-            point.trip_id = new_trip.id
-
-        personal_points_needed -= len(personal_points_banked)
-
-        # IF more points needed look for current personal points
-        if personal_points_needed > 0:
-
-            personal_points_current = db.session.query(PersonalPoint)\
-                .filter(PersonalPoint.use_year < current_use_year, PersonalPoint.use_year > previous_use_year)\
-                .filter(PersonalPoint.owner_id == new_trip.owner_id)\
-                .filter(PersonalPoint.trip_id.is_(None))\
-                .order_by("use_year").order_by("point_number")\
-                .limit(personal_points_needed).all()
-
-            for point in personal_points_current:
-                point.trip_id = new_trip.id
-
-            personal_points_needed -= len(personal_points_current)
-        else:
-            personal_points_current = []
+            new_trip = new_trip_with_fields(trip_owner, trip_bookable_room, trip_fields)
 
-        # IF more points needed look for borrow personal points
-        if personal_points_needed > 0:
-
-            personal_points_borrow = db.session.query(PersonalPoint) \
-                .filter(PersonalPoint.use_year < next_use_year, PersonalPoint.use_year > current_use_year) \
-                .filter(PersonalPoint.owner_id == new_trip.owner_id) \
-                .filter(PersonalPoint.trip_id.is_(None)) \
-                .order_by("use_year").order_by("point_number") \
-                .limit(personal_points_needed).all()
-
-            for point in personal_points_borrow:
-                point.trip_id = new_trip.id
+        # a lock timeout or serialization failure while allocating rolls back like a failed commit
+        try:
+            db.session.flush()
 
-            personal_points_needed -= len(personal_points_borrow)
-        else:
-            personal_points_borrow = []
+            # New trip is valid now try to allocate points
+            personal_allocated, actual_allocated, shortage = allocate_trip_points(new_trip)
+            if shortage:
+                db.session.rollback()
+                resp = {'message': shortage}
+                return resp, status.HTTP_400_BAD_REQUEST
 
-        # IF more personal points requirement was satisfied
-        if personal_points_needed > 0:
+            # ALL is good commit to db and return success
+            log_trip_allocation(new_trip, personal_allocated, actual_allocated)
+            db.session.commit()
+            availability_calendar.refresh()
+            result = trip_schema.dump(new_trip)
+            return result, status.HTTP_201_CREATED
+        except SQLAlchemyError as e:
             db.session.rollback()
-            resp = {
-                'message': 'personal points shortage of %s points' % personal_points_needed}
-            return resp, status.HTTP_400_BAD_REQUEST
-
-        # FIND actual points
-        actual_points_needed = new_trip.points_needed
-
-        actual_points_banked = db.session.query(ActualPoint)\
-            .filter(ActualPoint.use_year < previous_use_year, ActualPoint.use_year > previous_two_use_year)\
-            .filter(ActualPoint.trip_id.is_(None))\
-            .filter(ActualPoint.banked_date < booked_date) \
-            .order_by("use_year").order_by("point_number") \
-            .limit(actual_points_needed).all()
-
-        for point in actual_points_banked:
-            point.trip_id = new_trip.id
-
-        actual_points_needed -= len(actual_points_banked)
-
-        # IF actual points requirement is satisfied
-        if actual_points_needed > 0:
-
-            actual_points_current = db.session.query(ActualPoint)\
-                .filter(ActualPoint.use_year < current_use_year, ActualPoint.use_year > previous_use_year)\
-                .filter(ActualPoint.trip_id.is_(None))\
-                .filter(or_(ActualPoint.banked_date.is_(None), ActualPoint.banked_date > booked_date)) \
-                .order_by("use_year").order_by("point_number") \
-                .limit(actual_points_needed).all()
-
-            for point in actual_points_current:
-                point.trip_id = new_trip.id
-
-            actual_points_needed -= len(actual_points_current)
-        else:
-            actual_points_current = []
-
-        # IF actual points requirement is satisfied
-        if actual_points_needed > 0:
-
-            actual_points_borrow = db.session.query(ActualPoint)\
-                .filter(ActualPoint.use_year < next_use_year, ActualPoint.use_year > current_use_year)\
-                .filter(ActualPoint.trip_id.is_(None))\
-                .order_by("use_year").order_by("point_number")\
-                .limit(actual_points_needed).all()
-
-            for point in actual_points_borrow:
-                point.trip_id = new_trip.id
+            resp = jsonify({"error": str(e)})
+            resp.status_code = status.HTTP_400_BAD_REQUEST
+            return resp
 
-            actual_points_needed -= len(actual_points_borrow)
-        else:
-            actual_points_borrow = []
 
-        # IF more personal points requirement was satisfied
-        if actual_points_needed > 0:
-            db.session.rollback()
-            resp = {
-                'message': 'actual points shortage of %s points' % actual_points_needed}
+class TripBatchResource(Resource):
+    @jwt_required
+    def post(self):
+        request_list = request.get_json()
+        if not request_list:
+            resp = {'message': 'No input data provided'}
             return resp, status.HTTP_400_BAD_REQUEST
+        if not isinstance(request_list, list):
+            resp = {'message': 'a list of trips is required'}
+            return resp, status.HTTP_400_BAD_REQUEST
+
+        # every item is validated before the first query, an invalid one fails alone
+        results = [{'index': index} for index in range(len(request_list))]
+        valid_requests = []
+        for index, request_dict in enumerate(request_list):
+            errors = trip_schema.validate(request_dict)
+            if errors:
+                results[index].update({'status': status.HTTP_400_BAD_REQUEST, 'errors': errors})
+                continue
+            trip_fields, message = trip_fields_from_request(request_dict)
+            if message:
+                results[index].update({'status': status.HTTP_400_BAD_REQUEST, 'message': message})
+            else:
+                valid_requests.append((index, request_dict, trip_fields))
+
+        # resolve every owner named in the batch once, bookable rooms come from the reference data
+        owner_names = set(request_dict['owner']['name'] for index, request_dict, trip_fields in valid_requests)
+        owners = dict((owner.name, owner) for owner in
+                      Owner.query.options(lazyload('*')).filter(Owner.name.in_(owner_names)))
+        reference = reference_data.get()
+
+        bookings = []
+        for index, request_dict, trip_fields in valid_requests:
+            trip_owner = owners.get(request_dict['owner']['name'])
+            trip_bookable_room = attach(reference.bookable_room(request_dict['bookable_room']['resort']['name'],
+                                                                request_dict['bookable_room']['room_type']['name']))
+            message = None
+            if trip_owner is None:
+                message = 'owner does not exist'
+            elif trip_bookable_room is None:
+                message = 'bookable room does not exist'
+            if message:
+                results[index].update({'status': status.HTTP_400_BAD_REQUEST, 'message': message})
+            else:
+                bookings.append((trip_fields['booked_date'], trip_fields['check_in_date'], index,
+                                 trip_owner, trip_bookable_room, trip_fields))
 
-        # ALL is good commit to db and return success
+        # allocate in a deterministic order, earliest booked first, so the same batch always gets the same points
+        bookings.sort(key=lambda booking: booking[:3])
+        booked_trips = []
         try:
-            log_event(get_jwt_identity(), 'CREATE - ' + new_trip.__repr__())
-            log_event(get_jwt_identity(),
-                      'Personal Points Allocated: [%s,%s,%s]' % (len(personal_points_banked),
-                                                                 len(personal_points_current),
-                                                                 len(personal_points_borrow)))
-            log_event(get_jwt_identity(),
-                      'Actual Points Allocated: [%s,%s,%s]' % (len(actual_points_banked),
-                                                               len(actual_points_current),
-                                                               len(actual_points_borrow)))
+            for booked_date, check_in_date, index, trip_owner, trip_bookable_room, trip_fields in bookings:
+                savepoint = db.session.begin_nested()
+                new_trip = new_trip_with_fields(trip_owner, trip_bookable_room, trip_fields)
+                db.session.flush()
+                personal_allocated, actual_allocated, shortage = allocate_trip_points(new_trip)
+                if shortage:
+                    savepoint.rollback()
+                    results[index].update({'status': status.HTTP_400_BAD_REQUEST, 'message': shortage})
+                    continue
+                savepoint.commit()
+                log_trip_allocation(new_trip, personal_allocated, actual_allocated)
+                booked_trips.append((index, new_trip.id))
             db.session.commit()
-            result = trip_schema.dump(new_trip)
-            return result, status.HTTP_201_CREATED
         except SQLAlchemyError as e:
             db.session.rollback()
             resp = jsonify({"error": str(e)})
             resp.status_code = status.HTTP_400_BAD_REQUEST
             return resp
+
+        # the commit expired the booked trips, reload them all in one query rather than one each
+        if booked_trips:
+            trips = dict((trip.id, trip) for trip in Trip.query.options(*TRIP_LOADER_OPTIONS).
+                         filter(Trip.id.in_([trip_id for index, trip_id in booked_trips])))
+            for index, trip_id in booked_trips:
+                results[index].update({'status': status.HTTP_201_CREATED, 'trip': trip_serializer.dump(trips[trip_id])})
+            availability_calendar.refresh()
+        return {'created': len(booked_trips),
+                'failed': len(results) - len(booked_trips),
+                'results': results}, status.HTTP_200_OK
+
+
+class TripSimulationResource(Resource):
+    @jwt_required
+    def post(self):
+        """ Which candidate trips could be booked, and from which points, without booking any of them """
+        request_dict = request.get_json()
+        if not request_dict or not request_dict.get('candidates'):
+            resp = {'message': 'No input data provided'}
+            return resp, status.HTTP_400_BAD_REQUEST
+        candidates = request_dict['candidates']
+        if not isinstance(candidates, list):
+            resp = {'message': 'a list of candidates is required'}
+            return resp, status.HTTP_400_BAD_REQUEST
+
+        results = [{'index': index} for index in range(len(candidates))]
+        parsed = []
+        for index, candidate in enumerate(candidates):
+            try:
+                owner_name = candidate['owner']['name']
+                check_in_date = datetime.strptime(candidate['check_in_date'].split('T')[0], '%Y-%m-%d')
+                booked_date = datetime.strptime(candidate.get('booked_date', datetime.now().isoformat())
+                                                .split('T')[0], '%Y-%m-%d')
+                points_needed = int(candidate['points_needed'])
+            except (KeyError, TypeError, AttributeError, ValueError):
+                results[index]['message'] = 'owner, check_in_date and points_needed are required'
+                continue
+            results[index].update({'owner': owner_name,
+                                   'check_in_date': check_in_date.isoformat(),
+                                   'booked_date': booked_date.isoformat(),
+                                   'points_needed': points_needed})
+            parsed.append((index, owner_name, check_in_date, booked_date, points_needed))
+
+        owners = dict(db.session.query(Owner.name, Owner.id).
+                      filter(Owner.name.in_(set(candidate[1] for candidate in parsed))))
+        simulated = []
+        for index, owner_name, check_in_date, booked_date, points_needed in parsed:
+            if owner_name not in owners:
+                results[index]['message'] = 'owner does not exist'
+            elif points_needed < 1:
+                results[index]['message'] = 'points needed must be at least 1'
+            else:
+                simulated.append((index, owners[owner_name], check_in_date, booked_date, points_needed))
+
+        if simulated:
+            indexes, owner_ids, check_in_dates, booked_dates, points_needed = zip(*simulated)
+            personal_allocated, personal_shortage, actual_allocated, actual_shortage = \
+                PointSnapshot().simulate(owner_ids, check_in_dates, booked_dates, points_needed)
+            for position, index in enumerate(indexes):
+                result = results[index]
+                result['personal_points'] = dict(zip(('banked', 'current', 'borrow'),
+                                                     (int(bucket[position]) for bucket in personal_allocated)))
+                result['actual_points'] = dict(zip(('banked', 'current', 'borrow'),
+                                                   (int(bucket[position]) for bucket in actual_allocated)))
+                if personal_shortage[position] > 0:
+                    result['message'] = 'personal points shortage of %s points' % personal_shortage[position]
+                elif actual_shortage[position] > 0:
+                    result['message'] = 'actual points shortage of %s points' % actual_shortage[position]
+        for result in results:
+            result['feasible'] = 'message' not in result
+        return {'feasible': sum(result['feasible'] for result in results),
+                'results': results}